@@ -0,0 +1,61 @@
+# coding=utf-8
+# 对比各个解析后端在保存下来的页面上的解析耗时
+# 用法:
+#   python bench_extract.py save [fixture_dir]    抓取每个表格类源的第一页保存到 fixture_dir
+#   python bench_extract.py [fixture_dir] [repeat] 在 fixture_dir 的页面上对比 BeautifulSoup 原路径和各个后端
+import sys
+import os
+import time
+from bs4 import BeautifulSoup
+from extractor import BACKEND, lxml
+from source import XiCi, SixSix, CooBoBo, YunDaiLi, YunHai
+
+SOURCE = {
+    'XiCi': XiCi(style='nn'), 'SixSix': SixSix(), 'CooBoBo': CooBoBo(),
+    'YunDaiLi': YunDaiLi(style=1), 'YunHai': YunHai(style=1),
+}
+
+
+def save(fixture_dir):
+    if not os.path.exists(fixture_dir): os.makedirs(fixture_dir)
+    for name, source in SOURCE.items():
+        content = source.request(source._urls()[0])
+        with open(os.path.join(fixture_dir, '{}.html'.format(name)), 'w') as fp:
+            fp.write(content)
+        print 'save', name, len(content), 'bytes'
+
+
+def soup_tree(source, content):
+    # 原来的解析路径: html.parser 建完整 DOM, 再 find_all('tr') / find_all('td')
+    html = BeautifulSoup(content, 'html.parser')
+    return filter(None, (source._extract_row([td.text.strip() for td in tr.find_all('td')])
+                         for tr in html.find_all('tr')))
+
+
+def timeit(func, repeat):
+    begin_time = time.time()
+    for _ in range(repeat): result = func()
+    return result, (time.time() - begin_time) / repeat * 1000
+
+
+def bench(fixture_dir, repeat):
+    backends = [b for b in BACKEND if b != 'lxml' or lxml is not None]
+    print '{:<12}{:>10}{:>14}'.format('page', 'rows', 'bs4 tree') + ''.join('{:>14}'.format(b) for b in backends)
+    for name in sorted(os.listdir(fixture_dir)):
+        source = SOURCE.get(name.split('.')[0])
+        if source is None: continue
+        with open(os.path.join(fixture_dir, name)) as fp:
+            content = fp.read()
+        expect, cost = timeit(lambda: soup_tree(source, content), repeat)
+        line = '{:<12}{:>10}{:>12.2f}ms'.format(name.split('.')[0], len(expect), cost)
+        for backend in backends:
+            result, cost = timeit(lambda: source._parse(content, backend), repeat)
+            line += '{:>12.2f}ms'.format(cost) if result == expect else '{:>14}'.format('MISMATCH')
+        print line
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'save':
+        save(sys.argv[2] if len(sys.argv) > 2 else 'fixture')
+    else:
+        bench(sys.argv[1] if len(sys.argv) > 1 else 'fixture', int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,54 @@
+# coding=utf-8
+# ipool 服务的压测, 统计每秒请求数和延迟分位数
+# 用法: python bench_server.py url [processes] [threads] [duration] [keepalive]
+# 例如分别对 runserver 和 serve.py 启动的服务压测:
+#   python bench_server.py http://127.0.0.1:13579/ 4 16 10 1
+import sys
+import time
+import threading
+import requests
+from multiprocessing import Pool
+
+
+def hammer(args):
+    url, threads, duration, keepalive = args
+    latencies, errors = [], [0]
+    deadline = time.time() + duration
+
+    def run():
+        session = requests.Session() if keepalive else requests
+        while time.time() < deadline:
+            begin_time = time.time()
+            try:
+                if session.get(url, timeout=5).status_code != 200: raise Exception('error return code')
+                latencies.append(time.time() - begin_time)
+            except Exception:
+                errors[0] += 1
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    return latencies, errors[0]
+
+
+def percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)] if values else float('nan')
+
+
+if __name__ == '__main__':
+    url = sys.argv[1]
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    duration = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+    keepalive = sys.argv[5] != '0' if len(sys.argv) > 5 else True
+
+    pool = Pool(processes)
+    result = pool.map(hammer, [(url, threads, duration, keepalive)] * processes)
+    pool.close()
+    pool.join()
+    latencies = sorted(latency for latency_list, _ in result for latency in latency_list)
+    errors = sum(error for _, error in result)
+    print 'url: {}, clients: {}x{}, keepalive: {}'.format(url, processes, threads, keepalive)
+    print 'requests: {}, errors: {}, rps: {:.1f}'.format(len(latencies), errors, len(latencies) / duration)
+    print 'p50: {:.2f}ms, p90: {:.2f}ms, p99: {:.2f}ms'.format(
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.9) * 1000, percentile(latencies, 0.99) * 1000)
@@ -0,0 +1,116 @@
+# coding=utf-8
+# 对比 multiprocessing.Pool(200) 和 Validator 的校验吞吐与内存
+# 本地起一个假代理服务, 每个请求延迟 delay 秒后返回 json, 候选代理用 127.0.x.y 区分
+# 用法: python bench_validator.py [candidate_count] [delay]
+import sys
+import os
+import json
+import time
+import threading
+import multiprocessing
+import requests
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from validator import Validator, Target
+
+TARGET = 'http://bench.invalid/ware/searchList.action'
+DATA = {'_format_': 'json', 'stock': 1, 'page': 1}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0.2
+
+    def _respond(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.delay)
+        body = json.dumps({'value': '{}'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def ping(url):
+    begin_time = time.time()
+    try:
+        json.loads(requests.post(TARGET, data=DATA, proxies={'http': url, 'https': url}, timeout=5).content)
+        return int(100 * (time.time() - begin_time))
+    except Exception:
+        return None
+
+
+def rss(pid):
+    try:
+        with open('/proc/{}/status'.format(pid)) as fp:
+            for line in fp:
+                if line.startswith('VmRSS'): return int(line.split()[1])
+    except IOError:
+        pass
+    return 0
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pids):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pids = pids
+        self.peak = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, sum(rss(pid) for pid in self.pids()))
+            time.sleep(0.1)
+
+
+def bench_pool(candidates):
+    thread_pool = multiprocessing.Pool(200)
+    sampler = RSSSampler(lambda: [os.getpid()] + [p.pid for p in thread_pool._pool])
+    sampler.start()
+    begin_time = time.time()
+    valid = len(filter(lambda x: x is not None, thread_pool.map(ping, candidates)))
+    cost = time.time() - begin_time
+    sampler.running = False
+    thread_pool.close()
+    thread_pool.join()
+    return valid, cost, sampler.peak
+
+
+def bench_validator(candidates):
+    validator = Validator(targets=[Target('bench', TARGET, 'post', DATA, 'json')], concurrency=200)
+    sampler = RSSSampler(lambda: [os.getpid()])
+    sampler.start()
+    begin_time = time.time()
+    valid = sum(1 for _ in validator.validate(candidates))
+    cost = time.time() - begin_time
+    sampler.running = False
+    return valid, cost, sampler.peak
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    StubHandler.delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    server = StubServer(('', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    port = server.server_address[1]
+    candidates = ['http://127.0.{}.{}:{}'.format(i / 250, i % 250 + 1, port) for i in range(count)]
+
+    print 'candidates: {}, stub delay: {}s'.format(count, StubHandler.delay)
+    for name, bench in [('multiprocessing.Pool(200)', bench_pool), ('Validator(200)', bench_validator)]:
+        valid, cost, peak = bench(candidates)
+        print '{:<28}valid {:>6}  {:>8.2f}s  {:>8.1f} ping/s  peak rss {:>8.1f}MB'.format(
+            name, valid, cost, count / cost, peak / 1024.0)
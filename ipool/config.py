@@ -1,7 +1,9 @@
+# coding=utf-8
 import ConfigParser
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from retry import RetryPolicy
 
 cf = ConfigParser.ConfigParser()
 cf.read(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ipool.ini'))
@@ -12,6 +14,31 @@ DBSession = sessionmaker(engine)
 
 host = cf.get('ipoolserver', 'host')
 port = cf.get('ipoolserver', 'port')
+refresh_interval = int(cf.get('ipoolserver', 'refresh_interval')) if cf.has_option('ipoolserver', 'refresh_interval') else 5
+max_lease_size = int(cf.get('ipoolserver', 'max_lease_size')) if cf.has_option('ipoolserver', 'max_lease_size') else 500
+max_lease_ttl = int(cf.get('ipoolserver', 'max_lease_ttl')) if cf.has_option('ipoolserver', 'max_lease_ttl') else 600
+workers = int(cf.get('ipoolserver', 'workers')) if cf.has_option('ipoolserver', 'workers') else 4
+shm_path = cf.get('ipoolserver', 'shm_path') if cf.has_option('ipoolserver', 'shm_path') else '/dev/shm/ipool.index'
+
+# ip 池的存储后端, mysql 或 mmap (先写 mysql, 再发布到 store_path 供其他进程直接读取)
+store_backend = cf.get('store', 'backend') if cf.has_option('store', 'backend') else 'mysql'
+store_path = cf.get('store', 'path') if cf.has_option('store', 'path') else '/dev/shm/ipool.store'
+
+source_interval = float(cf.get('producer', 'source_interval')) if cf.has_option('producer', 'source_interval') else 1
+source_concurrency = int(cf.get('producer', 'source_concurrency')) if cf.has_option('producer', 'source_concurrency') else 3
+extractor = cf.get('producer', 'extractor') if cf.has_option('producer', 'extractor') else 'lxml'
+validate_concurrency = int(cf.get('producer', 'validate_concurrency')) if cf.has_option('producer', 'validate_concurrency') else 200
+dead_cache_path = cf.get('producer', 'dead_cache_path') if cf.has_option('producer', 'dead_cache_path') else None
+dead_cache_ttl = int(cf.get('producer', 'dead_cache_ttl')) if cf.has_option('producer', 'dead_cache_ttl') else 1800
+# 抓取 ip 源的重试和熔断, 见 retry.py
+retry_max_attempts = int(cf.get('producer', 'retry_max_attempts')) if cf.has_option('producer', 'retry_max_attempts') else 5
+retry_backoff = float(cf.get('producer', 'retry_backoff')) if cf.has_option('producer', 'retry_backoff') else 1.0
+breaker_threshold = int(cf.get('producer', 'breaker_threshold')) if cf.has_option('producer', 'breaker_threshold') else 5
+breaker_cooldown = int(cf.get('producer', 'breaker_cooldown')) if cf.has_option('producer', 'breaker_cooldown') else 300
+
+# 校验目标, 每个 [target:<name>] 一个, 第一个为主目标; 没有配置时只校验京东
+targets = [dict(cf.items(section, raw=True), name=section.split(':', 1)[1])
+           for section in cf.sections() if section.startswith('target:')]
 
 
 def return_none_when_exception(func):
@@ -25,11 +52,11 @@ def return_none_when_exception(func):
     return _return_none_when_exception
 
 
+# 返回 None 时退避重试, 最多 retry_max_attempts 次, 仍然失败时返回 None
 def repeat_while_return_none(func):
+    policy = RetryPolicy(retry_max_attempts, retry_backoff)
+
     def _repeat_while_return_none(*args, **kwargs):
-        result = func(*args, **kwargs)
-        while result is None:
-            result = func(*args, **kwargs)
-        return result
+        return policy.call(None, func, *args, **kwargs)
 
     return _repeat_while_return_none
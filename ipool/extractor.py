@@ -0,0 +1,81 @@
+# coding=utf-8
+import re
+from HTMLParser import HTMLParser
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+BACKEND = ('table', 'lxml', 'soup')
+IP_PATTERN = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$')
+
+
+def address(ip, port):
+    if not IP_PATTERN.match(ip) or not port.isdigit(): return None
+    return "http://{}:{}".format(ip, port)
+
+
+# 只识别 tr/td 的流式 tokenizer, 不建 DOM 树, 每读完一行输出该行所有 td 的文本
+class TableTokenizer(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self._rows = []
+        self._row = None
+        self._cell = None
+
+    def _close_cell(self):
+        if self._cell is not None and self._row is not None:
+            self._row.append(''.join(self._cell).strip())
+        self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row: self._rows.append(self._row)
+        self._row = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._close_row()
+            self._row = []
+        elif tag == 'td':
+            self._close_cell()
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag == 'td':
+            self._close_cell()
+        elif tag in ('tr', 'table', 'tbody'):
+            self._close_row()
+
+    def handle_data(self, data):
+        if self._cell is not None: self._cell.append(data)
+
+    def handle_entityref(self, name):
+        if self._cell is not None: self._cell.append(self.unescape('&{};'.format(name)))
+
+    def handle_charref(self, name):
+        if self._cell is not None: self._cell.append(self.unescape('&#{};'.format(name)))
+
+    def pop(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+
+def iter_rows(content, backend='table', chunk_size=8192):
+    # 没有安装 lxml 时退回到 table 后端
+    if backend == 'lxml' and lxml is not None:
+        for tr in lxml.html.fromstring(content).iter('tr'):
+            yield [td.text_content().strip() for td in tr.findall('td')]
+    elif backend == 'soup':
+        for tr in BeautifulSoup(content, 'html.parser').find_all('tr'):
+            yield [td.text.strip() for td in tr.find_all('td')]
+    else:
+        tokenizer = TableTokenizer()
+        for i in range(0, len(content), chunk_size):
+            tokenizer.feed(content[i:i + chunk_size])
+            for row in tokenizer.pop(): yield row
+        tokenizer.close()
+        tokenizer._close_row()
+        for row in tokenizer.pop(): yield row
@@ -0,0 +1,137 @@
+# coding=utf-8
+import threading
+import time
+from math import exp
+from bisect import bisect_right
+from random import random, randrange, sample
+
+STRATEGY = ('uniform', 'weighted', 'fastest')
+EMPTY = ([], [], [])
+
+
+# snapshot 为 (urls, speeds, cum_weight), 只要求三者支持下标访问和 len, 共享内存中的索引也走这两个函数
+def choose(snapshot, strategy='uniform', max_speed=None):
+    urls, speeds, cum_weight = snapshot
+    size = len(urls) if max_speed is None else bisect_right(speeds, max_speed)
+    if size == 0: return None
+    if strategy == 'fastest':
+        return urls[0]
+    if strategy == 'weighted':
+        return urls[min(bisect_right(cum_weight, random() * cum_weight[size - 1], 0, size), size - 1)]
+    return urls[randrange(size)]
+
+
+def pick(snapshot, n, strategy='uniform', max_speed=None):
+    urls, speeds, cum_weight = snapshot
+    size = len(urls) if max_speed is None else bisect_right(speeds, max_speed)
+    n = min(n, size)
+    if strategy == 'fastest':
+        return urls[:n]
+    if strategy == 'weighted':
+        picked = set()
+        for _ in range(3 * n):
+            if len(picked) == n: break
+            picked.add(choose(snapshot, strategy, max_speed))
+        return list(picked)
+    return [urls[i] for i in sample(xrange(size), n)]
+
+
+# 进程内的代理索引, 按固定间隔从存储后端 (见 store.py) 同步, 取代理时不访问存储
+# 存储后端的 signature 作为变更信号, 没有变化时不重新加载
+# 代理按 speed 升序存放, 同时预先计算 1/speed 的累积权重, 用于按速度加权抽样
+# 不指定 target 时使用主目标 (ip.speed) 可用的代理, 指定 target 时使用该目标可用的代理
+# 爬虫上报的成败按 alpha 做指数滑动平均得到每个代理的 score, 失败的影响随时间按 decay 秒指数衰减
+# 权重为 score/speed, score 低于 min_score 的代理直接移出索引; 上报的耗时同样滑动平均后代替校验的 speed
+class ProxyIndex:
+    def __init__(self, store, interval=5, timeout_speed=500, alpha=0.5, decay=600, min_score=0.2, publish=None):
+        self._store = store
+        self._interval = interval
+        self._publish = publish
+        self._timeout_speed = timeout_speed
+        self._alpha = alpha
+        self._decay = decay
+        self._min_score = min_score
+        self._rows = {}
+        # (url, target) -> [score, speed, update_time]
+        self._score = {}
+        self._snapshot = {}
+        self._signature = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._thread = None
+
+    def _current(self, key, now):
+        score, speed, update_time = self._score.get(key, (1.0, None, now))
+        return 1 - (1 - score) * exp(-(now - update_time) / float(self._decay)), speed
+
+    def _build(self, target, rows, now):
+        entries = []
+        for url, speed in rows:
+            score, reported_speed = self._current((url, target), now)
+            if score < self._min_score: continue
+            entries.append((reported_speed or speed or self._timeout_speed, score, url))
+        entries.sort()
+        urls, speeds, cum_weight = [], [], []
+        total = 0.0
+        for speed, score, url in entries:
+            total += score / max(speed, 1)
+            urls.append(url)
+            speeds.append(speed)
+            cum_weight.append(total)
+        return urls, speeds, cum_weight
+
+    def _rebuild(self, targets=None):
+        with self._build_lock:
+            now = time.time()
+            snapshot = {} if targets is None else dict(self._snapshot)
+            for target, rows in self._rows.items():
+                if targets is None or target in targets: snapshot[target] = self._build(target, rows, now)
+            self._snapshot = snapshot
+            if self._publish is not None: self._publish(snapshot)
+            # 超过 5 个 decay 的上报记录已经衰减到可以忽略
+            self._score = dict((key, value) for key, value in self._score.items() if now - value[2] < 5 * self._decay)
+
+    def report(self, records):
+        # records: [(url, target, ok, latency)], latency 单位为秒, 可以为空
+        now = time.time()
+        with self._build_lock:
+            for url, target, ok, latency in records:
+                score, speed = self._current((url, target), now)
+                score = (1 - self._alpha) * score + self._alpha * (1.0 if ok else 0.0)
+                if ok and latency is not None:
+                    latency = int(100 * latency)
+                    speed = latency if speed is None else int((1 - self._alpha) * speed + self._alpha * latency)
+                self._score[(url, target)] = [score, speed, now]
+        self._rebuild(set(target for _, target, _, _ in records))
+
+    def refresh(self, force=False):
+        signature = self._store.signature()
+        if not force and signature == self._signature: return False
+        self._rows, self._signature = self._store.load(), signature
+        self._rebuild()
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print 'refresh proxy index failed:', e
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None: return
+            self.refresh(force=True)
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def choice(self, strategy='uniform', max_speed=None, target=None):
+        return choose(self._snapshot.get(target, EMPTY), strategy, max_speed)
+
+    def sample(self, n, strategy='uniform', max_speed=None, target=None):
+        return pick(self._snapshot.get(target, EMPTY), n, strategy, max_speed)
+
+    def __len__(self):
+        return len(self._snapshot.get(None, EMPTY)[0])
@@ -0,0 +1,18 @@
+# coding=utf-8
+import threading
+import time
+
+
+# 按域名限速, 同一个域名相邻两次请求的开始时间至少间隔 interval 秒, 线程安全
+class RateLimiter:
+    def __init__(self, interval):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def wait(self, domain):
+        with self._lock:
+            now = time.time()
+            at = max(now, self._next.get(domain, 0))
+            self._next[domain] = at + self._interval
+        if at > now: time.sleep(at - now)
@@ -1,3 +1,4 @@
+# coding=utf-8
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, String, DateTime, Integer
 
@@ -20,6 +21,18 @@ class IP(BaseModel):
         return '{}\t{}\t{}'.format(self.url, self.update_time, self.speed)
 
 
+# 代理在每个校验目标上的结果, speed 为空表示该目标校验失败
+class IPTarget(BaseModel):
+    __tablename__ = 'ip_target'
+    url = Column(String(35), primary_key=True)
+    target = Column(String(16), primary_key=True)
+    update_time = Column(DateTime)
+    speed = Column(Integer)
+
+    def __repr__(self):
+        return '{}\t{}\t{}\t{}'.format(self.url, self.target, self.update_time, self.speed)
+
+
 if __name__ == '__main__':
     from config import engine
 
@@ -1,35 +1,12 @@
 # coding=utf-8
-from source import XiCi, SixSix, QuanMin, CooBoBo, YunDaiLi, YunHai, Data5U
-from model import IP
-from config import DATABASE_URI
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime
-import multiprocessing
+from source import Source, XiCi, SixSix, QuanMin, CooBoBo, YunDaiLi, YunHai, Data5U
+from validator import Validator, Target, JD
+from scheduler import Scheduler, NegativeCache
+from store import create_store
+from config import validate_concurrency, dead_cache_path, dead_cache_ttl, targets
+from multiprocessing.dummy import Pool
+import threading
 import time
-import requests
-import json
-
-
-def get(source):
-    return source.get()
-
-
-def ping(url):
-    ip = IP(url=url, update_time=datetime.now())
-    begin_time = time.time()
-    try:
-        respond = requests.post(
-            url='https://so.m.jd.com/ware/searchList.action',
-            data={'_format_': 'json', 'stock': 1, 'page': 1, 'keyword': '手机'},
-            proxies=ip.to_proxy(),
-            timeout=5
-        ).content
-        json.loads(respond)
-        ip.speed = int(100 * (time.time() - begin_time))
-    except Exception:
-        ip = None
-    return ip
 
 
 class Producer:
@@ -41,40 +18,70 @@ class Producer:
             #YunHai(style=1), YunHai(style=2), YunHai(style=3), YunHai(style=4),
         ]
         self._heart_beat = 600
+        self._tick = 10
+        self._validator = Validator(targets=[Target(**target) for target in targets] or [JD],
+                                    concurrency=validate_concurrency)
+        self._dead = NegativeCache(ttl=dead_cache_ttl, path=dead_cache_path)
+        self._scheduler = Scheduler(self._dead)
+        self._store = create_store()
 
-    def _dump(self):
-        print 'start to get ip from source'
-        thread_pool = multiprocessing.Pool(15)
-        proxy_url = reduce(lambda x, y: x + y, thread_pool.map(get, self._source))
-        thread_pool.close()
-        thread_pool.join()
-        print 'get ip from source finish, ip count:', len(proxy_url)
+    def _harvest_source(self, source):
+        # 每抓完一页就把该页的代理加入调度器, 不等整个源抓完
+        count, added = 0, 0
+        for page in source.iter_pages():
+            count += len(page)
+            added += self._scheduler.add(page)
+        return count, added
 
-        print 'start to ping JD'
-        thread_pool = multiprocessing.Pool(200)
-        ip_list = thread_pool.map(ping, proxy_url)
+    def _harvest(self):
+        print 'start to get ip from source'
+        thread_pool = Pool(len(self._source))
+        count, added = 0, 0
+        for source_count, source_added in thread_pool.imap_unordered(self._harvest_source, self._source):
+            count += source_count
+            added += source_added
         thread_pool.close()
         thread_pool.join()
-        print 'ping JD finish, valid ip count:', len(filter(lambda x: x is not None, ip_list))
+        print 'get ip from source finish, ip count: {}, new ip count: {}, known dead: {}'.format(
+            count, added, len(self._dead))
+        for domain, stats in sorted(Source._retry.stats().items()):
+            print 'source {} calls: {calls}, retries: {retries}, giveups: {giveups}, rejected: {rejected}'.format(
+                domain, **stats)
 
-        print 'start to dump ip to mysql'
+    def _check(self):
+        url_list = self._scheduler.due()
+        if not url_list: return
+        ip_list = []
+        for ip in self._validator.validate(url_list):
+            self._scheduler.success(ip.url, min(speed for speed in ip.targets.values() if speed is not None))
+            ip_list.append(ip)
+        valid_url = set(ip.url for ip in ip_list)
+        invalid_url = [url for url in url_list if url not in valid_url]
+        evicted = sum(1 for url in invalid_url if self._scheduler.failure(url))
+        # 校验失败但还没被淘汰的 ip 不对外提供, 之后重新校验通过会再写回来
+        self._store.save(ip_list, invalid_url)
+        if evicted: self._dead.save()
+        print 'check {} ip finish, valid: {}, invalid: {}, evicted: {}, known: {}'.format(
+            len(url_list), len(ip_list), len(invalid_url), evicted, len(self._scheduler))
 
-        engine = create_engine(DATABASE_URI, pool_recycle=3600, encoding='utf-8')
-        DBSession = sessionmaker(engine)
-        session = DBSession()
-        session.query(IP).delete()
-        for ip in filter(lambda x: x is not None, ip_list):
-            ip_in_db = session.query(IP).filter_by(url=ip.url).first()
-            if not ip_in_db:
-                session.add(ip)
-        session.commit()
-        session.close()
-        print 'dump ip to mysql finish'
+    def _harvest_forever(self):
+        while True:
+            try:
+                self._harvest()
+            except Exception as e:
+                print 'harvest failed:', e
+            time.sleep(self._heart_beat)
 
     def serve(self):
+        # 抓取源在后台线程中进行, 抓到的代理直接加入调度器, 校验循环不受抓取耗时影响, 始终每 _tick 秒检查一次
+        self._store.sync()
+        self._scheduler.add(self._store.urls())
+        thread = threading.Thread(target=self._harvest_forever)
+        thread.daemon = True
+        thread.start()
         while True:
-            self._dump()
-            time.sleep(self._heart_beat)
+            self._check()
+            time.sleep(self._tick)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,116 @@
+# coding=utf-8
+import threading
+import time
+from random import random
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+# 按 key (一般是域名) 熔断, 连续 threshold 次失败且来自 threshold 个不同的 source (一般是代理) 后 cooldown 秒内不放行
+# 只有明确是对方网站的问题 (5xx、429) 才应该记为失败, 代理本身连不上不算; 不给 source 时每次失败都算不同的来源
+# 冷却结束后只放行一次试探, 成功则恢复, 失败则重新熔断
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=60):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._condition = threading.Condition()
+        self._failures = {}
+        self._open_until = {}
+
+    def allow(self, key):
+        with self._condition:
+            until = self._open_until.get(key)
+            if until is None: return True
+            now = time.time()
+            if now < until: return False
+            self._open_until[key] = now + self._cooldown
+            return True
+
+    def wait(self, key, timeout):
+        # 等到放行为止, 试探成功时提前醒来, 超过 timeout 秒仍未放行返回 False
+        deadline = time.time() + timeout
+        with self._condition:
+            while not self.allow(key):
+                now = time.time()
+                if now >= deadline: return False
+                self._condition.wait(min(self._open_until.get(key, now), deadline) - now)
+            return True
+
+    def success(self, key):
+        with self._condition:
+            self._failures.pop(key, None)
+            self._open_until.pop(key, None)
+            self._condition.notify_all()
+
+    def failure(self, key, source=None):
+        with self._condition:
+            sources = self._failures.setdefault(key, set())
+            sources.add(source if source is not None else len(sources))
+            if len(sources) >= self._threshold:
+                self._open_until[key] = time.time() + self._cooldown
+
+
+# 重试策略: 最多 max_attempts 次, 第 n 次重试前等待 min(max_backoff, backoff * 2^(n-1)) 秒, 并随机缩短最多 jitter 的比例
+# 配了 breaker 时, 熔断中的 key 等到冷却结束再试, 不消耗重试次数, 最多等 max_wait 秒
+# 按 key 统计调用次数 calls、重试次数 retries、用完次数仍失败的 giveups、等待熔断的 waits、等待超时被拒绝的 rejected
+# 用法:
+#   for attempt in policy.attempts(domain):
+#       try: ...; policy.success(domain); break
+#       except Exception: policy.failure(domain)
+class RetryPolicy:
+    def __init__(self, max_attempts=5, backoff=1.0, max_backoff=60, jitter=0.5, breaker=None, max_wait=600):
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._jitter = jitter
+        self._breaker = breaker
+        self._max_wait = max_wait
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _count(self, key, metric):
+        with self._lock:
+            stats = self._stats.setdefault(key, {'calls': 0, 'retries': 0, 'giveups': 0, 'waits': 0, 'rejected': 0})
+            stats[metric] += 1
+
+    def delay(self, attempt):
+        return min(self._max_backoff, self._backoff * 2 ** (attempt - 1)) * (1 - self._jitter * random())
+
+    def attempts(self, key=None):
+        self._count(key, 'calls')
+        for attempt in range(1, self._max_attempts + 1):
+            if attempt > 1:
+                self._count(key, 'retries')
+                time.sleep(self.delay(attempt - 1))
+            if self._breaker is not None and not self._breaker.allow(key):
+                self._count(key, 'waits')
+                if not self._breaker.wait(key, self._max_wait):
+                    self._count(key, 'rejected')
+                    return
+            yield attempt
+        self._count(key, 'giveups')
+
+    def success(self, key=None):
+        if self._breaker is not None: self._breaker.success(key)
+
+    def failure(self, key=None, source=None):
+        if self._breaker is not None: self._breaker.failure(key, source)
+
+    def call(self, key, func, *args, **kwargs):
+        # 抛异常或返回 None 都算失败, 用完次数或被熔断时返回 None
+        for attempt in self.attempts(key):
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                result = None
+            if result is not None:
+                self.success(key)
+                return result
+            self.failure(key)
+        return None
+
+    def stats(self):
+        with self._lock:
+            return dict((key, dict(stats)) for key, stats in self._stats.items())
@@ -0,0 +1,116 @@
+# coding=utf-8
+import heapq
+import json
+import os
+import threading
+import time
+
+
+# 最近被淘汰的代理, ttl 秒内再从源中抓到时直接跳过, 不再占用校验的超时时间
+# 保存在 path 指定的 json 文件中, producer 重启后仍然有效
+class NegativeCache:
+    def __init__(self, ttl=1800, path=None):
+        self._ttl = ttl
+        self._path = path
+        self._expire = {}
+        self.load()
+
+    def add(self, url, now=None):
+        self._expire[url] = (time.time() if now is None else now) + self._ttl
+
+    def purge(self, now=None):
+        now = time.time() if now is None else now
+        self._expire = dict((url, expire) for url, expire in self._expire.items() if expire > now)
+
+    def load(self):
+        if self._path is None or not os.path.exists(self._path): return
+        try:
+            with open(self._path) as fp:
+                self._expire = json.load(fp)
+        except ValueError:
+            self._expire = {}
+        self.purge()
+
+    def save(self):
+        if self._path is None: return
+        self.purge()
+        with open(self._path + '.tmp', 'w') as fp:
+            json.dump(self._expire, fp)
+        os.rename(self._path + '.tmp', self._path)
+
+    def __contains__(self, url):
+        expire = self._expire.get(url)
+        return expire is not None and expire > time.time()
+
+    def __len__(self):
+        return len(self._expire)
+
+
+# 滚动校验调度器, 用小顶堆按下次校验时间维护所有已知代理
+# 速度越快的代理校验间隔越长, 校验失败的代理很快重新校验, 连续失败 max_failures 次后淘汰
+# 从未校验成功过的新代理失败一次即淘汰, 淘汰的代理放入 dead, 在其过期前不会再次加入
+# 后台抓取线程 add, 校验循环 due/success/failure, 所有方法都在 _lock 内执行
+class Scheduler:
+    def __init__(self, dead, min_interval=60, max_interval=1800, retry_interval=30, max_failures=3, fast_speed=100):
+        self._dead = dead
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._retry_interval = retry_interval
+        self._max_failures = max_failures
+        self._fast_speed = fast_speed
+        self._heap = []
+        # url -> [speed, failures, next_check]
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _push(self, url, next_check):
+        self._state[url][2] = next_check
+        heapq.heappush(self._heap, (next_check, url))
+
+    def add(self, urls, now=None):
+        now = time.time() if now is None else now
+        added = 0
+        with self._lock:
+            for url in urls:
+                if url in self._state or url in self._dead: continue
+                self._state[url] = [None, 0, None]
+                self._push(url, now)
+                added += 1
+        return added
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        urls = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                next_check, url = heapq.heappop(self._heap)
+                # 同一个 url 重新排期后堆里会留下旧记录, 以 _state 为准
+                if url in self._state and self._state[url][2] == next_check:
+                    urls.append(url)
+        return urls
+
+    def _interval(self, speed):
+        return max(self._min_interval, self._max_interval * self._fast_speed / max(speed, self._fast_speed))
+
+    def success(self, url, speed, now=None):
+        with self._lock:
+            state = self._state[url]
+            state[0], state[1] = speed, 0
+            self._push(url, (time.time() if now is None else now) + self._interval(speed))
+
+    def failure(self, url, now=None):
+        with self._lock:
+            state = self._state[url]
+            state[1] += 1
+            if state[0] is None or state[1] >= self._max_failures:
+                del self._state[url]
+                self._dead.add(url, now)
+                return True
+            self._push(url, (time.time() if now is None else now) + self._retry_interval * state[1])
+            return False
+
+    def __contains__(self, url):
+        return url in self._state
+
+    def __len__(self):
+        return len(self._state)
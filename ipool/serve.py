@@ -0,0 +1,72 @@
+# coding=utf-8
+# 多进程的 ipool 服务, 用法: python serve.py
+# 主进程维护 ProxyIndex 并把每次重建的索引发布到共享内存, 预先 fork 出 workers 个进程共同监听端口
+# 每个 worker 是开启 HTTP/1.1 keep-alive 的多线程 WSGI 服务, 直接从共享内存读取索引
+# worker 收到的 /report 通过队列交给主进程, 主进程更新 score 后重新发布
+import signal
+import socket
+import sys
+import threading
+import time
+from multiprocessing import Process, Queue
+from werkzeug.serving import make_server, WSGIRequestHandler
+from config import host, port, refresh_interval, workers, shm_path
+from index import ProxyIndex
+from shm import Publisher, SharedIndex
+from store import create_store
+import server
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def consume(index, reports):
+    while True:
+        records = reports.get()
+        try:
+            index.report(records)
+        except Exception as e:
+            print 'report failed:', e
+
+
+def work(sock, reports):
+    server.index = SharedIndex(shm_path, reports)
+    server.index.start()
+    make_server(host, int(port), server.app, threaded=True, request_handler=KeepAliveHandler,
+                fd=sock.fileno()).serve_forever()
+
+
+def spawn(sock, reports):
+    process = Process(target=work, args=(sock, reports))
+    process.daemon = True
+    process.start()
+    return process
+
+
+if __name__ == '__main__':
+    # 正常退出时 multiprocessing 会结束所有 daemon worker
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    reports = Queue()
+    index = ProxyIndex(create_store(), interval=refresh_interval, publish=Publisher(shm_path))
+    index.start()
+    consumer = threading.Thread(target=consume, args=(index, reports))
+    consumer.daemon = True
+    consumer.start()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(1024)
+    print 'serve on {}:{} with {} workers'.format(host, port, workers)
+
+    processes = [spawn(sock, reports) for _ in range(workers)]
+    while True:
+        time.sleep(1)
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                print 'worker {} exit with code {}, restart'.format(process.pid, process.exitcode)
+                processes[i] = spawn(sock, reports)
@@ -5,22 +5,55 @@ reload(sys)
 sys.setdefaultencoding('utf-8')
 
 import json
-from random import choice
-from flask import Flask
+import time
+from flask import Flask, request, abort
 from flask.ext.script import Manager, Server
-from config import DBSession, host, port
-from model import IP
+from config import host, port, refresh_interval, max_lease_size, max_lease_ttl
+from index import ProxyIndex, STRATEGY
+from store import create_store
 
 app = Flask(__name__)
+index = ProxyIndex(create_store(), interval=refresh_interval)
+
+
+@app.before_first_request
+def start_index():
+    # uwsgi 在 fork 之后才会处理请求, 刷新线程需要在 worker 内启动
+    index.start()
+
+
+def get_strategy():
+    strategy = request.args.get('strategy', 'uniform')
+    if strategy not in STRATEGY: abort(400)
+    return strategy
 
 
 @app.route('/')
 def get():
-    session = DBSession()
-    valid_ip = session.query(IP).all()
-    proxies = None if valid_ip == [] else choice(valid_ip).to_proxy()
-    session.close()
-    return json.dumps(proxies) if proxies is not None else 'None'
+    url = index.choice(strategy=get_strategy(), max_speed=request.args.get('max_speed', type=int),
+                       target=request.args.get('target'))
+    return json.dumps({'http': url, 'https': url}) if url is not None else 'None'
+
+
+@app.route('/lease')
+def lease():
+    n = min(max(request.args.get('n', 50, type=int), 1), max_lease_size)
+    ttl = min(max(request.args.get('ttl', 60, type=int), 1), max_lease_ttl)
+    proxies = index.sample(n, strategy=get_strategy(), max_speed=request.args.get('max_speed', type=int),
+                           target=request.args.get('target'))
+    return json.dumps({'expire': int(time.time()) + ttl, 'proxies': proxies})
+
+
+@app.route('/report', methods=['POST'])
+def report():
+    # [{"proxy": "http://ip:port", "ok": true, "latency": 0.8, "target": "douban"}, ...]
+    try:
+        records = [(record['proxy'], record.get('target'), bool(record['ok']), record.get('latency'))
+                   for record in json.loads(request.get_data())]
+    except (ValueError, KeyError, TypeError):
+        abort(400)
+    index.report(records)
+    return 'ok'
 
 
 if __name__ == "__main__":
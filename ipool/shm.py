@@ -0,0 +1,121 @@
+# coding=utf-8
+import mmap
+import os
+import struct
+import threading
+from index import choose, pick, EMPTY
+
+URL_SIZE = 40
+HEADER = struct.Struct('<4sI')
+ENTRY = struct.Struct('<16sIQ')
+VERSION = struct.Struct('<Q')
+
+
+# 共享内存中的索引文件格式:
+#   HEADER: 'IPIX', target 个数
+#   ENTRY * target 个数: target 名 (主目标为空), 代理个数, 数据块偏移
+#   每个数据块: 代理个数 * 40 字节 url, 代理个数 * int32 speed, 代理个数 * float64 cum_weight
+# 另有一个 8 字节的 .version 文件, 每次发布新的索引文件后加一, 读者据此判断是否需要重新映射
+def dump(snapshot, path):
+    targets = sorted(snapshot.items())
+    offset = HEADER.size + ENTRY.size * len(targets)
+    entries, blocks = [], []
+    for target, (urls, speeds, cum_weight) in targets:
+        count = len(urls)
+        entries.append(ENTRY.pack((target or '').encode('utf-8'), count, offset))
+        block = struct.pack('<' + '{}s'.format(URL_SIZE) * count, *[str(url) for url in urls]) + \
+                struct.pack('<{}i'.format(count), *speeds) + struct.pack('<{}d'.format(count), *cum_weight)
+        blocks.append(block)
+        offset += len(block)
+    with open(path + '.tmp', 'wb') as fp:
+        fp.write(HEADER.pack('IPIX', len(targets)))
+        fp.write(''.join(entries))
+        fp.write(''.join(blocks))
+    os.rename(path + '.tmp', path)
+
+
+def open_version(path, access):
+    if not os.path.exists(path + '.version'):
+        with open(path + '.version', 'wb') as fp:
+            fp.write(VERSION.pack(0))
+    with open(path + '.version', 'r+b' if access == mmap.ACCESS_WRITE else 'rb') as fp:
+        return mmap.mmap(fp.fileno(), VERSION.size, access=access)
+
+
+# ProxyIndex 的 publish 回调, 在主进程中把每次重建的索引写入共享内存
+class Publisher:
+    def __init__(self, path):
+        self._path = path
+        self._version = open_version(path, mmap.ACCESS_WRITE)
+
+    def __call__(self, snapshot):
+        dump(snapshot, self._path)
+        VERSION.pack_into(self._version, 0, VERSION.unpack_from(self._version, 0)[0] + 1)
+
+
+# 共享内存中的一列, 支持下标访问和 len, 不拷贝数据
+class Column:
+    def __init__(self, buf, offset, count, fmt):
+        self._buf = buf
+        self._offset = offset
+        self._count = count
+        self._struct = struct.Struct(fmt)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(self._count))]
+        if i < 0: i += self._count
+        if not 0 <= i < self._count: raise IndexError(i)
+        value = self._struct.unpack_from(self._buf, self._offset + i * self._struct.size)[0]
+        return value.rstrip('\0') if isinstance(value, str) else value
+
+
+# worker 进程中的只读索引, 接口与 ProxyIndex 相同, 直接在共享内存上做二分查找
+# report 通过 reports 队列交给主进程的 ProxyIndex 处理
+class SharedIndex:
+    def __init__(self, path, reports=None):
+        self._path = path
+        self._reports = reports
+        self._lock = threading.Lock()
+        self._version = None
+        self._current = None
+        self._snapshot = {}
+
+    def start(self):
+        with self._lock:
+            if self._version is None: self._version = open_version(self._path, mmap.ACCESS_READ)
+
+    def _load(self):
+        version = VERSION.unpack_from(self._version, 0)[0]
+        if version == self._current: return self._snapshot
+        with self._lock:
+            if version == self._current: return self._snapshot
+            with open(self._path, 'rb') as fp:
+                buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            snapshot = {}
+            for i in range(HEADER.unpack_from(buf, 0)[1]):
+                target, count, offset = ENTRY.unpack_from(buf, HEADER.size + i * ENTRY.size)
+                target = target.rstrip('\0').decode('utf-8') or None
+                snapshot[target] = (
+                    Column(buf, offset, count, '{}s'.format(URL_SIZE)),
+                    Column(buf, offset + URL_SIZE * count, count, '<i'),
+                    Column(buf, offset + (URL_SIZE + 4) * count, count, '<d'),
+                )
+            # 旧的 mmap 由仍在使用它的请求持有, 用完后自动释放
+            self._snapshot, self._current = snapshot, version
+        return snapshot
+
+    def choice(self, strategy='uniform', max_speed=None, target=None):
+        return choose(self._load().get(target, EMPTY), strategy, max_speed)
+
+    def sample(self, n, strategy='uniform', max_speed=None, target=None):
+        return pick(self._load().get(target, EMPTY), n, strategy, max_speed)
+
+    def report(self, records):
+        if self._reports is not None: self._reports.put(records)
+
+    def __len__(self):
+        return len(self._load().get(None, EMPTY)[0])
@@ -1,16 +1,37 @@
 # coding=utf-8
 import re
 import requests
+import threading
 import time
+from urlparse import urlparse
+from multiprocessing.dummy import Pool
 from bs4 import BeautifulSoup
-from config import DATABASE_URI, return_none_when_exception, repeat_while_return_none
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from model import IP
+from config import source_interval, source_concurrency, extractor
+from config import retry_max_attempts, retry_backoff, breaker_threshold, breaker_cooldown
+from config import return_none_when_exception
+from limiter import RateLimiter
+from retry import RetryPolicy, CircuitBreaker
+from extractor import iter_rows, address
+from store import create_store
 from random import choice
 
 
 class Source:
+    # 所有源共用一个按域名的限速器和一份代理缓存, 代理缓存每 _proxy_ttl 秒从存储后端刷新一次
+    # 同一个域名同时最多有 source_concurrency 个请求在进行
+    # 请求失败按 _retry 退避重试, 同一个域名经多个不同的代理连续返回 5xx 或 429 时熔断, 熔断期间直接放弃, 下一轮抓取再试
+    # 池里的代理连不上只换一个代理重试, 不计入熔断; 只在真正发请求时占用域名的并发数, 退避等待时不占用
+    _limiter = RateLimiter(source_interval)
+    _retry = RetryPolicy(retry_max_attempts, retry_backoff, breaker=CircuitBreaker(breaker_threshold, breaker_cooldown),
+                         max_wait=0)
+    _semaphore_lock = threading.Lock()
+    _semaphore = {}
+    _store = create_store()
+    _proxy_lock = threading.Lock()
+    _proxy_cache = []
+    _proxy_expire = 0
+    _proxy_ttl = 60
+
     def __init__(self):
         self._headers = requests.utils.default_headers()
         self._headers.update({
@@ -22,24 +43,75 @@ class Source:
             'Accept-Encoding': 'gzip, deflate, sdch',
             'Accept-Language': 'zh-CN,zh;q=0.8',
         })
+        self._session = requests.Session()
+        self._session.headers = self._headers
 
-    def get(self):
-        pass
+    def _urls(self):
+        return []
+
+    # 表格类的源实现 _extract_row, 由 extractor 配置的后端逐行解析
+    # 其他源实现 _extract, 使用 BeautifulSoup 解析整个页面
+    _extract_row = None
+
+    def _extract(self, html):
+        return []
 
-    @repeat_while_return_none
     @return_none_when_exception
+    def _parse(self, content, backend=extractor):
+        if self._extract_row is None:
+            return self._extract(BeautifulSoup(content, 'html.parser')) or []
+        return filter(None, (self._extract_row(cells) for cells in iter_rows(content, backend)))
+
+    def _domain_semaphore(self, domain):
+        with Source._semaphore_lock:
+            if domain not in Source._semaphore:
+                Source._semaphore[domain] = threading.BoundedSemaphore(source_concurrency)
+            return Source._semaphore[domain]
+
+    def _fetch(self, url):
+        return self._parse(self.request(url)) or []
+
+    def iter_pages(self):
+        # 并发抓取所有分页, 按完成顺序逐页产出解析出的代理
+        urls = self._urls()
+        if not urls: return
+        thread_pool = Pool(min(len(urls), source_concurrency))
+        try:
+            for url in thread_pool.imap_unordered(self._fetch, urls):
+                yield url
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+
+    def get(self):
+        return [url for page in self.iter_pages() for url in page]
+
+    def _proxy(self):
+        with Source._proxy_lock:
+            if time.time() >= Source._proxy_expire:
+                Source._proxy_cache = Source._store.urls()
+                Source._proxy_expire = time.time() + Source._proxy_ttl
+        if not Source._proxy_cache: return None
+        url = choice(Source._proxy_cache)
+        return {'http': url, 'https': url}
+
     def request(self, url):
-        engine = create_engine(DATABASE_URI, pool_recycle=3600, encoding='utf-8')
-        DBSession = sessionmaker(engine)
-        session = DBSession()
-        valid_ip = session.query(IP).all()
-        proxy = None if valid_ip == [] else choice(valid_ip).to_proxy()
-        session.close()
-        req = requests.get(url, headers=self._headers, proxies=proxy, timeout=5)
-        if req.status_code != 200: raise Exception('error return code')
-        print 'request', url, 'by', proxy, 'success'
-        time.sleep(3)
-        return req.content
+        domain = urlparse(url).netloc
+        for attempt in Source._retry.attempts(domain):
+            try:
+                proxy = self._proxy()
+                with self._domain_semaphore(domain):
+                    self._limiter.wait(domain)
+                    req = self._session.get(url, proxies=proxy, timeout=5)
+            except Exception:
+                continue
+            if req.status_code == 200:
+                Source._retry.success(domain)
+                print 'request', url, 'by', proxy, 'success'
+                return req.content
+            if req.status_code == 429 or req.status_code >= 500:
+                Source._retry.failure(domain, proxy and proxy.get('http'))
+        return None
 
 
 class XiCi(Source):
@@ -48,23 +120,13 @@ class XiCi(Source):
         self.style = style
         self.url = 'http://www.xicidaili.com/{style}/{page}'.format(style=style, page='{page}')
 
-    @return_none_when_exception
-    def _extract(self, html):
-        url = []
-        for tr in html.find_all('tr'):
-            td = tr.find_all('td')
-            if not td or td[5].text != 'HTTP': continue
-            url.append("http://{}:{}".format(td[1].text, td[2].text))
-        return url
+    def _extract_row(self, cells):
+        if len(cells) < 6 or cells[5] != 'HTTP': return None
+        return address(cells[1], cells[2])
 
-    def get(self):
-        url = []
+    def _urls(self):
         page_range = {'nn': range(1, 11), 'nt': range(1, 2), 'wt': range(1, 10)}
-        for page in page_range[self.style]:
-            content = self.request(self.url.format(page=page))
-            html = BeautifulSoup(content, 'html.parser')
-            url += self._extract(html) or []
-        return url
+        return [self.url.format(page=page) for page in page_range[self.style]]
 
 
 class SixSix(Source):
@@ -72,23 +134,12 @@ class SixSix(Source):
         Source.__init__(self)
         self.url = "http://www.66ip.cn/{}.html"
 
-    @return_none_when_exception
-    def _extract(self, html):
-        url = []
-        table = html.find_all('table')[2]
-        for tr in table.find_all('tr'):
-            td = tr.find_all('td')
-            if not td or td[0].text == 'ip': continue
-            url.append("http://{}:{}".format(td[0].text, td[1].text))
-        return url
+    def _extract_row(self, cells):
+        if len(cells) < 2: return None
+        return address(cells[0], cells[1])
 
-    def get(self):
-        url = []
-        for page in range(2, 12):
-            content = self.request(self.url.format(page))
-            html = BeautifulSoup(content, 'html.parser')
-            url += self._extract(html) or []
-        return url
+    def _urls(self):
+        return [self.url.format(page) for page in range(2, 12)]
 
 
 class QuanMin(Source):
@@ -119,13 +170,8 @@ class QuanMin(Source):
             url.append("http://{}:{}".format(ip, port))
         return url
 
-    def get(self):
-        url = []
-        for i in range(1, 11):
-            content = self.request(self.url.format(i))
-            html = BeautifulSoup(content, 'html.parser')
-            url += self._extract(html) or []
-        return url
+    def _urls(self):
+        return [self.url.format(i) for i in range(1, 11)]
 
 
 # todo: 需要图像识别
@@ -166,23 +212,12 @@ class CooBoBo(Source):
         Source.__init__(self)
         self.url = "http://www.coobobo.com/free-http-proxy/{}"
 
-    @return_none_when_exception
-    def _extract(self, html):
-        url = []
-        table = html.find_all('tbody')[0]
-        for tr in table.find_all('tr'):
-            td = tr.find_all('td')
-            if not td: continue
-            url.append("http://{}:{}".format(td[0].text, td[1].text))
-        return url
+    def _extract_row(self, cells):
+        if len(cells) < 2: return None
+        return address(cells[0], cells[1])
 
-    def get(self):
-        url = []
-        for page in range(1, 11):
-            content = self.request(self.url.format(page))
-            html = BeautifulSoup(content, 'html.parser')
-            url += self._extract(html) or []
-        return url
+    def _urls(self):
+        return [self.url.format(page) for page in range(1, 11)]
 
 
 class YunDaiLi(Source):
@@ -190,23 +225,12 @@ class YunDaiLi(Source):
         Source.__init__(self)
         self.url = "http://www.ip3366.net/?stype={style}&page={page}".format(style=style, page="{page}")
 
-    @return_none_when_exception
-    def _extract(self, html):
-        url = []
-        table = html.find_all('tbody')[0]
-        for tr in table.find_all('tr'):
-            td = tr.find_all('td')
-            if not td or td[3] == 'HTTPS': continue
-            url.append("http://{}:{}".format(td[0].text, td[1].text))
-        return url
+    def _extract_row(self, cells):
+        if len(cells) < 4 or cells[3] == 'HTTPS': return None
+        return address(cells[0], cells[1])
 
-    def get(self):
-        url = []
-        for page in range(1, 8):
-            content = self.request(self.url.format(page=page))
-            html = BeautifulSoup(content, 'html.parser')
-            url += self._extract(html) or []
-        return url
+    def _urls(self):
+        return [self.url.format(page=page) for page in range(1, 8)]
 
 
 class YunHai(Source):
@@ -214,23 +238,12 @@ class YunHai(Source):
         Source.__init__(self)
         self.url = "http://www.kxdaili.com/dailiip/{style}/{page}.html".format(style=style, page='{page}')
 
-    @return_none_when_exception
-    def _extract(self, html):
-        url = []
-        table = html.find_all('tbody')[0]
-        for tr in table.find_all('tr'):
-            td = tr.find_all('td')
-            if not td: continue
-            url.append("http://{}:{}".format(td[0].text, td[1].text))
-        return url
+    def _extract_row(self, cells):
+        if len(cells) < 2: return None
+        return address(cells[0], cells[1])
 
-    def get(self):
-        url = []
-        for page in range(1, 11):
-            content = self.request(self.url.format(page=page))
-            html = BeautifulSoup(content, 'html.parser')
-            url += self._extract(html) or []
-        return url
+    def _urls(self):
+        return [self.url.format(page=page) for page in range(1, 11)]
 
 
 class Data5U(Source):
@@ -259,10 +272,5 @@ class Data5U(Source):
             url.append("http://{}:{}".format(cell[0].text, port))
         return url
 
-    def get(self):
-        url = []
-        for style in ['gngn', 'gnpt', 'gwgn', 'gwpt']:
-            content = self.request(self.url.format(style))
-            html = BeautifulSoup(content, 'html.parser')
-            url += self._extract(html) or []
-        return url
+    def _urls(self):
+        return [self.url.format(style) for style in ['gngn', 'gnpt', 'gwgn', 'gwpt']]
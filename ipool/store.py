@@ -0,0 +1,137 @@
+# coding=utf-8
+import marshal
+import mmap
+import os
+from sqlalchemy import text, select, func
+from config import engine, store_backend, store_path
+from model import IP, IPTarget
+from shm import open_version, VERSION
+
+UPSERT = text(
+    'INSERT INTO ip (url, update_time, speed) VALUES (:url, :update_time, :speed) '
+    'ON DUPLICATE KEY UPDATE update_time = VALUES(update_time), speed = VALUES(speed)'
+)
+UPSERT_TARGET = text(
+    'INSERT INTO ip_target (url, target, update_time, speed) VALUES (:url, :target, :update_time, :speed) '
+    'ON DUPLICATE KEY UPDATE update_time = VALUES(update_time), speed = VALUES(speed)'
+)
+
+
+def group(ips, targets):
+    # 转成 ProxyIndex 使用的 {target: [(url, speed)]}, None 为主目标, 只保留校验通过的代理
+    rows = {None: [(url, speed) for url, speed in ips if speed is not None]}
+    for url, target, speed in targets:
+        if speed is not None: rows.setdefault(target, []).append((url, speed))
+    return rows
+
+
+# ip 池的存储后端, 所有后端提供相同的接口:
+#   signature: 变更信号, 没有变化时 ProxyIndex 不重新加载
+#   load: {target: [(url, speed)]}
+#   urls: 池中所有代理
+#   save: producer 写入一轮校验结果
+# mysql 是持久化的默认后端
+class MySQLStore:
+    def __init__(self, batch_size=500):
+        self._batch_size = batch_size
+
+    def signature(self):
+        return tuple(engine.execute(select([func.count(IP.url), func.max(IP.update_time)])).first())
+
+    def fetch(self):
+        ips = engine.execute(select([IP.url, IP.speed])).fetchall()
+        targets = engine.execute(select([IPTarget.url, IPTarget.target, IPTarget.speed])).fetchall()
+        return ips, targets
+
+    def load(self):
+        return group(*self.fetch())
+
+    def urls(self):
+        return [url for url, in engine.execute(select([IP.url]))]
+
+    def sync(self):
+        pass
+
+    def save(self, ip_list, invalid_url):
+        # 分批 upsert 校验通过的 ip, 分批删除校验失败的 ip, 整个过程在一个事务内
+        rows = [{'url': ip.url, 'update_time': ip.update_time, 'speed': ip.speed} for ip in ip_list]
+        target_rows = [{'url': ip.url, 'target': target, 'update_time': ip.update_time, 'speed': speed}
+                       for ip in ip_list for target, speed in ip.targets.items()]
+        with engine.begin() as connection:
+            for i in range(0, len(rows), self._batch_size):
+                connection.execute(UPSERT, rows[i:i + self._batch_size])
+            for i in range(0, len(target_rows), self._batch_size):
+                connection.execute(UPSERT_TARGET, target_rows[i:i + self._batch_size])
+            for i in range(0, len(invalid_url), self._batch_size):
+                batch = invalid_url[i:i + self._batch_size]
+                connection.execute(IP.__table__.delete().where(IP.url.in_(batch)))
+                connection.execute(IPTarget.__table__.delete().where(IPTarget.url.in_(batch)))
+
+
+# 共享内存后端: producer 先写 mysql, 再把整个池 marshal 到 path (一般在 /dev/shm 下) 并把 path.version 加一
+# 其他进程读 version 判断是否有变化, 有变化时才重新读文件, 全程不访问数据库
+class MmapStore:
+    def __init__(self, path, durable=None):
+        self._path = path
+        self._durable = durable or MySQLStore()
+        self._version = None
+        self._current = None
+        self._data = ([], [])
+        # producer 写入时维护的整个池: {url: speed}, {(url, target): speed}
+        self._ips = None
+        self._targets = None
+
+    def signature(self):
+        if self._version is None:
+            if not os.path.exists(self._path): return None
+            self._version = open_version(self._path, mmap.ACCESS_READ)
+        return VERSION.unpack_from(self._version, 0)[0]
+
+    def fetch(self):
+        version = self.signature()
+        if version is not None and version != self._current:
+            with open(self._path, 'rb') as fp:
+                self._data = marshal.load(fp)
+            self._current = version
+        return self._data
+
+    def load(self):
+        return group(*self.fetch())
+
+    def urls(self):
+        return [url for url, _ in self.fetch()[0]]
+
+    def save(self, ip_list, invalid_url):
+        self._durable.save(ip_list, invalid_url)
+        if self._ips is None: return self.sync()
+        for ip in ip_list:
+            self._ips[ip.url] = ip.speed
+            for target, speed in ip.targets.items():
+                self._targets[(ip.url, target)] = speed
+        invalid = set(invalid_url)
+        for url in invalid: self._ips.pop(url, None)
+        self._targets = dict((key, speed) for key, speed in self._targets.items() if key[0] not in invalid)
+        self.publish()
+
+    def sync(self):
+        # producer 启动时从 mysql 加载整个池并发布
+        ips, targets = self._durable.fetch()
+        self._ips = dict((url, speed) for url, speed in ips)
+        self._targets = dict(((url, target), speed) for url, target, speed in targets)
+        self.publish()
+
+    def publish(self):
+        data = (
+            [(str(url), speed) for url, speed in self._ips.items()],
+            [(str(url), unicode(target), speed) for (url, target), speed in self._targets.items()],
+        )
+        with open(self._path + '.tmp', 'wb') as fp:
+            marshal.dump(data, fp)
+        os.rename(self._path + '.tmp', self._path)
+        version = open_version(self._path, mmap.ACCESS_WRITE)
+        VERSION.pack_into(version, 0, VERSION.unpack_from(version, 0)[0] + 1)
+        version.close()
+
+
+def create_store():
+    return MmapStore(store_path) if store_backend == 'mmap' else MySQLStore()
@@ -0,0 +1,83 @@
+# coding=utf-8
+import json
+import time
+from datetime import datetime
+from multiprocessing.dummy import Pool
+import requests
+from model import IP
+
+
+# 一个校验目标: 用 method 请求 url, 返回 200 且内容满足 check 才算通过
+# check 可以是 json (内容能解析成 json), status (只看返回码), contains:<text> (内容包含 text)
+class Target:
+    def __init__(self, name, url, method='get', data=None, check='status'):
+        self.name = name
+        self.url = url
+        self.method = method.lower()
+        self.data = json.loads(data) if isinstance(data, basestring) else data
+        self.check = check
+
+    def ok(self, respond):
+        if respond.status_code != 200: return False
+        if self.check == 'json':
+            json.loads(respond.content)
+        elif self.check.startswith('contains:'):
+            return self.check[len('contains:'):] in respond.content
+        return True
+
+
+JD = Target(
+    'jd', 'https://so.m.jd.com/ware/searchList.action', 'post',
+    {'_format_': 'json', 'stock': 1, 'page': 1, 'keyword': '手机'}, 'json'
+)
+
+
+# 单进程的代理校验器, 用线程池代替原来 200 个进程的 multiprocessing.Pool
+# 所有线程共用一个 requests.Session, 同一个代理的连接在整轮校验中复用
+# 每个 (代理, 目标) 是一个独立的任务, 同一个代理的所有目标并发校验
+# validate 按完成顺序逐个产出至少通过一个目标的代理, ip.targets 记录每个目标的 speed (失败为 None)
+# ip.speed 为第一个目标 (主目标) 的 speed
+class Validator:
+    def __init__(self, targets=(JD,), concurrency=200, timeout=5):
+        self._targets = targets
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._session = None
+
+    def _mount(self):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self._concurrency, pool_maxsize=self._concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def ping(self, task):
+        url, target = task
+        begin_time = time.time()
+        try:
+            respond = self._session.request(
+                target.method, target.url, data=target.data, proxies={'http': url, 'https': url}, timeout=self._timeout
+            )
+            speed = int(100 * (time.time() - begin_time)) if target.ok(respond) else None
+        except Exception:
+            speed = None
+        return url, target.name, speed
+
+    def validate(self, urls):
+        self._session = self._mount()
+        thread_pool = Pool(self._concurrency)
+        result = {}
+        try:
+            tasks = ((url, target) for url in urls for target in self._targets)
+            for url, name, speed in thread_pool.imap_unordered(self.ping, tasks):
+                result.setdefault(url, {})[name] = speed
+                if len(result[url]) < len(self._targets): continue
+                targets = result.pop(url)
+                if all(speed is None for speed in targets.values()): continue
+                ip = IP(url=url, update_time=datetime.now(), speed=targets[self._targets[0].name])
+                ip.targets = targets
+                yield ip
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+            self._session.close()
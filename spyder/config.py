@@ -7,6 +7,12 @@ import json
 import os
 import logging
 import requests
+import threading
+import time
+from random import choice
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from ipool.retry import RetryPolicy
 
 reload(sys)
 sys.setdefaultencoding('utf-8')
@@ -18,6 +24,8 @@ cf.read(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.ini'))
 DATABASE_URI = cf.get('base', 'db_uri')
 POOL_URL = cf.get('base', 'pool_url')
 HEADER = json.loads(cf.get('base', 'header'))
+LEASE_SIZE = int(cf.get('base', 'lease_size')) if cf.has_option('base', 'lease_size') else 50
+LEASE_TTL = int(cf.get('base', 'lease_ttl')) if cf.has_option('base', 'lease_ttl') else 60
 engine = create_engine(DATABASE_URI, pool_recycle=3600, encoding='utf-8')
 DBSession = sessionmaker(engine)
 logging.basicConfig(
@@ -28,9 +36,115 @@ logging.basicConfig(
 logger = logging.getLogger()
 
 
-def get_proxy():
-    proxy = requests.get(POOL_URL).content
-    return None if proxy == 'None' else json.loads(proxy)
+# 一次从 ip 池租用一批代理, 在本地随机取用, 租期剩余不足 1/4 时在后台续租
+class ProxyLease:
+    def __init__(self, size=LEASE_SIZE, ttl=LEASE_TTL, target=None):
+        self._url = POOL_URL.rstrip('/') + '/lease'
+        self._ttl = ttl
+        self._params = {'n': size, 'ttl': ttl}
+        if target is not None: self._params['target'] = target
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # multiprocessing fork 出来的子进程不继承父进程的续租线程
+        self._pid = os.getpid()
+        self._proxies = []
+        self._expire = 0
+        self._refilling = False
+        self._retry_at = 0
+
+    def _fetch(self):
+        try:
+            respond = json.loads(requests.get(self._url, params=self._params, timeout=5).content)
+            if respond['proxies']:
+                self._proxies, self._expire = respond['proxies'], respond['expire']
+        finally:
+            self._refilling = False
+
+    def get(self):
+        if self._pid != os.getpid(): self._reset()
+        now = time.time()
+        if not self._proxies or now >= self._expire:
+            # 冷启动或租约过期时只由一个线程同步租用, 其余线程等它租完; 租不到代理时 1 秒内不再重试
+            with self._lock:
+                now = time.time()
+                if (not self._proxies or now >= self._expire) and now >= self._retry_at:
+                    self._retry_at = now + 1
+                    self._fetch()
+        elif self._expire - now < self._ttl / 4.0:
+            with self._lock:
+                refill, self._refilling = not self._refilling, True
+            if refill:
+                thread = threading.Thread(target=self._fetch)
+                thread.daemon = True
+                thread.start()
+        proxies = self._proxies
+        if not proxies: return None
+        url = choice(proxies)
+        return {'http': url, 'https': url}
+
+
+# 代理的使用结果先放在本地缓冲区, 攒够 batch_size 条或每隔 interval 秒由后台线程批量上报给 ip 池
+# 上报失败直接丢弃, 不影响抓取
+class ProxyReporter:
+    def __init__(self, batch_size=50, interval=5):
+        self._url = POOL_URL.rstrip('/') + '/report'
+        self._batch_size = batch_size
+        self._interval = interval
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._thread = None
+
+    def _flush(self):
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if not records: return
+        try:
+            requests.post(self._url, data=json.dumps(records), timeout=5)
+        except Exception:
+            pass
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            self._flush()
+
+    def _background(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def report(self, proxy, ok, latency=None, target=None):
+        if proxy is None: return
+        if self._pid != os.getpid(): self._reset()
+        with self._lock:
+            if self._thread is None: self._thread = self._background(self._run)
+            self._buffer.append({'proxy': proxy.get('http'), 'ok': ok, 'latency': latency, 'target': target})
+            full = len(self._buffer) >= self._batch_size
+        if full: self._background(self._flush)
+
+
+# 每个校验目标一份租约, 不指定 target 时租用主目标 (京东) 可用的代理
+proxy_leases = {}
+proxy_leases_lock = threading.Lock()
+proxy_reporter = ProxyReporter()
+
+
+def get_proxy(target=None):
+    with proxy_leases_lock:
+        if target not in proxy_leases: proxy_leases[target] = ProxyLease(target=target)
+        lease = proxy_leases[target]
+    return lease.get()
+
+
+def report_proxy(proxy, ok, latency=None, target=None):
+    proxy_reporter.report(proxy, ok, latency, target)
 
 
 class return_none_when_exception:
@@ -45,16 +159,25 @@ class return_none_when_exception:
         return result
 
 
+# 返回 None 时退避重试, 最多 crawler_max_attempts 次, 仍然失败时返回 None
 class repeat_while_return_none:
     def __init__(self, func):
         self.func = func
+        self.policy = RetryPolicy(crawler_max_attempts, crawler_backoff)
 
     def __call__(self, *args, **kwargs):
-        result = self.func(*args, **kwargs)
-        while result is None:
-            result = self.func(*args, **kwargs)
-        return result
+        return self.policy.call(None, self.func, *args, **kwargs)
+
 
+# 抓取器配置, 见 crawler.py
+crawler_concurrency = int(cf.get('crawler', 'concurrency')) if cf.has_option('crawler', 'concurrency') else 50
+crawler_domain_concurrency = int(cf.get('crawler', 'domain_concurrency')) if cf.has_option('crawler', 'domain_concurrency') else 10
+crawler_domain_interval = float(cf.get('crawler', 'domain_interval')) if cf.has_option('crawler', 'domain_interval') else 0.2
+crawler_timeout = float(cf.get('crawler', 'timeout')) if cf.has_option('crawler', 'timeout') else 5
+crawler_max_attempts = int(cf.get('crawler', 'max_attempts')) if cf.has_option('crawler', 'max_attempts') else 5
+crawler_backoff = float(cf.get('crawler', 'backoff')) if cf.has_option('crawler', 'backoff') else 1.0
+crawler_breaker_threshold = int(cf.get('crawler', 'breaker_threshold')) if cf.has_option('crawler', 'breaker_threshold') else 10
+crawler_breaker_cooldown = int(cf.get('crawler', 'breaker_cooldown')) if cf.has_option('crawler', 'breaker_cooldown') else 60
 
 # 京东配置
 JD_url = cf.get('jd', 'url')
@@ -67,6 +190,9 @@ lagou_max_iter = int(cf.get('lagou', 'max_iter'))
 lagou_city_json = json.loads(cf.get('lagou', 'city_json'))
 lagou_stage_json = json.loads(cf.get('lagou', 'stage_json'))
 lagou_domain_json = json.loads(cf.get('lagou', 'domain_json'))
+lagou_concurrency = int(cf.get('lagou', 'concurrency')) if cf.has_option('lagou', 'concurrency') else 5
+lagou_interval = float(cf.get('lagou', 'interval')) if cf.has_option('lagou', 'interval') else 1.0
+lagou_probe_ttl = int(cf.get('lagou', 'probe_ttl')) if cf.has_option('lagou', 'probe_ttl') else 7
 
 # 汽车之家配置
 autohome_car_url = cf.get('autohome', 'car_url')
@@ -75,6 +201,7 @@ autohome_brand_json = json.loads(cf.get('autohome', 'brand_json'))
 
 # 魔兽世界拍卖行
 wow_url = dict(zip(cf.options('wow'), [cf.get('wow', realm) for realm in cf.options('wow')]))
+wow_snapshot_path = cf.get('wow_snapshot', 'path') if cf.has_option('wow_snapshot', 'path') else '/data/wow/snapshot'
 
 # 豆瓣
 book_tag_list = cf.get('douban', 'book_tags').split(',')
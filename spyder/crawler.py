@@ -0,0 +1,164 @@
+# coding=utf-8
+import sys
+import threading
+import time
+from collections import namedtuple
+from Queue import Queue
+from urlparse import urlparse
+import requests
+from spyder.config import HEADER, get_proxy, report_proxy
+from spyder.config import crawler_concurrency, crawler_domain_concurrency, crawler_domain_interval
+from spyder.config import crawler_timeout, crawler_max_attempts, crawler_backoff
+from spyder.config import crawler_breaker_threshold, crawler_breaker_cooldown
+from ipool.retry import RetryPolicy, CircuitBreaker, CircuitOpen
+from ipool.limiter import RateLimiter
+
+# 一个待抓取的请求, meta 原样带到 parse 和结果中, 用来标记分页、关键字等
+Request = namedtuple('Request', 'url method data headers meta')
+Request.__new__.__defaults__ = ('get', None, None, None)
+
+# 一个请求的抓取结果, 成功时 error 为 None, records 是 parse 的返回值
+# 增量抓取时内容没有变化的请求 changed 为 False, records 为空
+Result = namedtuple('Result', 'request records error attempts elapsed changed')
+
+
+# 单个域名的并发数和请求间隔限制, 线程安全, 请求间隔由所有域名共用的 RateLimiter 控制
+class DomainGate:
+    def __init__(self, domain, concurrency, limiter):
+        self._domain = domain
+        self._semaphore = threading.Semaphore(concurrency)
+        self._limiter = limiter
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        self._limiter.wait(self._domain)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._semaphore.release()
+
+
+# 所有爬虫共用的抓取器, 用一个进程内的线程池代替每个爬虫 20~25 个进程的 multiprocessing.Pool
+# 所有线程共用一个 requests.Session, 同一域名的并发数和请求间隔分别由 domain_concurrency 和 domain_interval 限制
+# 每次尝试从 ip 池换一个代理并上报使用结果, 请求失败或 parse 抛异常时按 ipool/retry.py 的策略退避重试, 最多 max_attempts 次
+# target 为 ip 池的校验目标名 (见 ipool.ini 的 [target:<name>]), 租用代理和上报结果都按该目标, 不指定时为主目标 (京东)
+# ip 池没有对应校验目标的爬虫应当传 report=False, 否则会用别的网站的结果给主目标的代理打分
+# 同一域名经 breaker_threshold 个不同的代理连续返回 5xx 或 429 后熔断 breaker_cooldown 秒, 期间该域名的请求等待冷却结束
+# 等待超过 ipool/retry.py 的 max_wait 仍未恢复时以 CircuitOpen 失败
+# 传入 state (state.py 的 CrawlStateStore) 时做增量抓取: 带上次的 ETag/Last-Modified 发条件请求, 304 或解析结果没变的请求不产出记录
+# 爬虫只需提供请求的生成器和 parse(respond, request), crawl 按完成顺序产出 Result
+class Crawler:
+    def __init__(self, concurrency=crawler_concurrency, domain_concurrency=crawler_domain_concurrency,
+                 domain_interval=crawler_domain_interval, timeout=crawler_timeout,
+                 max_attempts=crawler_max_attempts, backoff=crawler_backoff,
+                 breaker_threshold=crawler_breaker_threshold, breaker_cooldown=crawler_breaker_cooldown,
+                 target=None, report=True, state=None):
+        self._concurrency = concurrency
+        self._domain_concurrency = domain_concurrency
+        self._timeout = timeout
+        self._max_attempts = max_attempts
+        self._retry = RetryPolicy(max_attempts, backoff, breaker=CircuitBreaker(breaker_threshold, breaker_cooldown))
+        self._target = target
+        self._report = report
+        self._state = state
+        self._limiter = RateLimiter(domain_interval)
+        self._gates = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _gate(self, domain):
+        with self._lock:
+            if domain not in self._gates:
+                self._gates[domain] = DomainGate(domain, self._domain_concurrency, self._limiter)
+            return self._gates[domain]
+
+    def fetch(self, request, parse):
+        begin_time = time.time()
+        domain = urlparse(request.url).netloc
+        error, attempts = None, 0
+        headers = request.headers or HEADER
+        if self._state is not None:
+            key = self._state.key(request.url, request.data)
+            headers = dict(headers, **self._state.conditional(key))
+        for attempts in self._retry.attempts(domain):
+            proxy, respond = None, None
+            try:
+                proxy = get_proxy(self._target)
+                with self._gate(domain):
+                    start = time.time()
+                    respond = self._session.request(
+                        request.method, request.url, data=request.data, headers=headers,
+                        proxies=proxy, timeout=self._timeout
+                    )
+                    latency = time.time() - start
+                if respond.status_code not in (200, 304):
+                    raise Exception('error return code {}'.format(respond.status_code))
+            except Exception as e:
+                if self._report: report_proxy(proxy, False, target=self._target)
+                # 连接失败、超时等只说明代理不可用, 5xx 和 429 才算对方网站的问题, 计入熔断
+                if respond is not None and (respond.status_code == 429 or respond.status_code >= 500):
+                    self._retry.failure(domain, proxy and proxy.get('http'))
+                error = e
+                continue
+            # 上报的耗时只算请求本身, 解析失败不是代理的问题, 不上报
+            try:
+                records, changed = [], False
+                if respond.status_code == 200:
+                    records = parse(respond, request)
+                    changed = self._state is None or self._state.changed(
+                        key, records, respond.headers.get('ETag'), respond.headers.get('Last-Modified'))
+                    if not changed: records = []
+            except Exception as e:
+                error = e
+                continue
+            if self._report: report_proxy(proxy, True, latency, self._target)
+            self._retry.success(domain)
+            return Result(request, records, None, attempts, time.time() - begin_time, changed)
+        # 没用完重试次数就结束说明等熔断超时了
+        if attempts < self._max_attempts: error = CircuitOpen(domain)
+        return Result(request, None, error, attempts, time.time() - begin_time, False)
+
+    def stats(self):
+        return self._retry.stats()
+
+    def crawl(self, pending, parse):
+        # 请求按需从生成器中取, 结果队列有界, 消费慢时抓取线程阻塞, 内存中的结果不超过 concurrency * 2 个
+        # 提前退出迭代时不再取新的请求, 等在途的请求结束后返回; 生成请求时抛出的异常在在途请求结束后重新抛出
+        pending = iter(pending)
+        results = Queue(self._concurrency * 2)
+        lock = threading.Lock()
+        stop = threading.Event()
+        errors = []
+
+        def work():
+            try:
+                while not stop.is_set():
+                    with lock:
+                        request = next(pending, None)
+                    if request is None: break
+                    results.put(self.fetch(request, parse))
+            except Exception:
+                errors.append(sys.exc_info())
+                stop.set()
+            finally:
+                results.put(None)
+
+        for _ in range(self._concurrency):
+            thread = threading.Thread(target=work)
+            thread.daemon = True
+            thread.start()
+        running = self._concurrency
+        try:
+            while running:
+                result = results.get()
+                if result is None:
+                    running -= 1
+                else:
+                    yield result
+        finally:
+            stop.set()
+            while running:
+                if results.get() is None: running -= 1
+        if errors: raise errors[0][0], errors[0][1], errors[0][2]
@@ -1,79 +1,102 @@
 # coding=utf-8
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import random
+import re
 import string
 import sys
 import os
-import time
 from datetime import date
-import shutil
-import multiprocessing
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir)))
-from spyder.config import DBSession, HEADER, get_proxy
+from spyder.config import HEADER, logger
 from spyder.config import book_tag_list as TAG_LIST
-from spyder.config import return_none_when_exception, repeat_while_return_none
+from spyder.crawler import Crawler, Request
+from spyder.state import CrawlStateStore
 from spyder.model import DoubanBook
+from spyder.writer import BulkWriter
 
+SUBJECT_ITEM = SoupStrainer('li', class_='subject-item')
+SUBJECT_ID = re.compile(r'/subject/(\d+)')
+# 评价人数不足时显示为 "(少于10人评价)" 或 "(目前无人评价)", 此时 votes 为空
+VOTES = re.compile(ur'\((\d+)人评价\)')
+# 价格形如 "39.00元"、"CNY 68.00"、"USD 12.99"、"$12.99"、"29.8"
+PRICE = re.compile(ur'^(?:[A-Z]{2,3}\$?\s*|[$¥￥€£]\s*)?(\d+(?:\.\d+)?)\s*(?:元|圆)?$')
 
-def get(tag):
-    time.sleep(1)
-    proxy = get_proxy()
-    HEADER.update({"Cookie": "bid=%s" % "".join(random.sample(string.ascii_letters + string.digits, 11))})
-    book_list = []
-    for pos in range(0, 1000, 20):
-        url = "https://book.douban.com/tag/{}?start={}&type=T".format(tag, pos)
-        req = requests.get(url, proxies=proxy, headers=HEADER, timeout=5)
-        if req.status_code != 200: raise Exception('error return code')
-        html = BeautifulSoup(req.content, 'html.parser')
-        book_list += html.find_all("li", class_='subject-item') or []
-    print 'get {} by {} done'.format(tag, proxy.get('http'))
-    time.sleep(4)
-    fp = open('/tmp/{}_douban_book/{}'.format(date.today(), tag), 'w')
-    map(lambda book: fp.writelines('{}\n'.format(book.prettify().replace('\n', ' '))), book_list)
-    fp.close()
-    return len(book_list)
+
+def text(tag):
+    return tag.get_text(strip=True) if tag is not None else None
+
+
+def price(part):
+    # pub 的最后一段不一定是价格, 没有价格时是出版日期, 4 位以上的纯整数当作年份
+    match = PRICE.match(part)
+    if match is None or (part == match.group(1) and '.' not in part and len(part) >= 4): return None
+    return part[:32]
+
+
+# 每本书解析成一行结构化的记录, pub 形如 "作者 / 译者 / 出版社 / 出版日期 / 价格", 作者取第一段, 最后一段像价格时作为价格
+def extract(book):
+    link = book.find('h2').find('a')
+    subject_id = SUBJECT_ID.search(link.get('href', ''))
+    pub = [part.strip() for part in (text(book.find('div', class_='pub')) or '').split('/')]
+    rating = text(book.find('span', class_='rating_nums'))
+    votes = VOTES.match(text(book.find('span', class_='pl')) or '')
+    return {
+        'subject_id': int(subject_id.group(1)) if subject_id else None,
+        'title': (link.get('title') or text(link))[:255],
+        'author': pub[0][:255] if len(pub) > 1 else None,
+        'rating': float(rating) if rating else None,
+        'votes': int(votes.group(1)) if votes else None,
+        'price': price(pub[-1]) if len(pub) > 1 else None,
+    }
+
+
+def parse(respond, request):
+    # 只解析 subject-item 节点, 不为整个页面建 DOM
+    html = BeautifulSoup(respond.content, 'html.parser', parse_only=SUBJECT_ITEM)
+    return [extract(book) for book in html.find_all('li', class_='subject-item')]
+
+
+def pages():
+    # 每个标签用一个随机的 bid cookie 翻完所有分页
+    for tag in TAG_LIST:
+        header = dict(HEADER, Cookie="bid=%s" % "".join(random.sample(string.ascii_letters + string.digits, 11)))
+        for pos in range(0, 1000, 20):
+            yield Request("https://book.douban.com/tag/{}?start={}&type=T".format(tag, pos), headers=header, meta=tag)
+
+
+def commit(writer, state, done):
+    # 先写入记录再提交抓取状态
+    writer.flush()
+    state.commit(state.key(request.url, request.data) for request in done)
 
 
 if __name__ == '__main__':
-    print 'start to clean env'
-    path = '/tmp/{}_douban_book/'.format(date.today())
-    if os.path.exists(path):
-        shutil.rmtree(path)
-    os.mkdir(path)
+    # 增量抓取: 只有内容变化的分页会写入当天的记录, 所以不再清理当天的数据
+    # 记录只在 commit 时和抓取状态一起写入, 崩溃后重抓的分页不会重复写入
+    writer = BulkWriter(DoubanBook, batch_size=None)
+    state = CrawlStateStore()
 
     print 'start to get douban books data'
-    pool = multiprocessing.Pool(processes=20)
-    count = reduce(
-        lambda x, y: x + y,
-        pool.map(
-            repeat_while_return_none(return_none_when_exception(get)),
-            TAG_LIST
-        )
-    )
-    pool.close()
-    pool.join()
-    print 'get douban books data finish, book count: {}'.format(count)
-
-    print 'start to clean mysql dirty data'
-    session = DBSession()
-    session.query(DoubanBook).filter_by(create_date=date.today()).delete()
-    session.commit()
-    session.close()
-
-    print 'start to dump douban book data to mysql'
-    for tag in TAG_LIST:
-        session = DBSession()
-        fp = open('/tmp/{}_douban_book/{}'.format(date.today(), tag))
-        data = [DoubanBook(tag=tag, html=line, create_date=date.today()) for line in fp]
-        session.add_all(data)
-        fp.close()
-        print 'dump {} to mysql finish'.format(tag)
-        session.commit()
-        session.close()
-    print 'dump douban book to mysql finish'
-    
-    print 'finally, clean env'
-    shutil.rmtree(path)
+    crawler = Crawler(target='douban', state=state)
+    done, unchanged = [], 0
+    for result in crawler.crawl(pages(), parse):
+        if result.error is not None:
+            logger.warning('get {} failed: {}'.format(result.request.url, result.error))
+            continue
+        # 内容没变但 ETag 变了的分页也有暂存的状态, 同样要提交
+        done.append(result.request)
+        if not result.changed:
+            unchanged += 1
+            continue
+        for book in result.records:
+            book.update(tag=result.request.meta, create_date=date.today())
+        writer.extend(result.records)
+        if len(done) >= 50:
+            commit(writer, state, done)
+            done = []
+    commit(writer, state, done)
+    print 'dump douban book to mysql finish, book count: {}, unchanged pages: {}'.format(writer.count, unchanged)
+    logger.warning('retry stats: {}'.format(crawler.stats()))
+
     print 'all done'
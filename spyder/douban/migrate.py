@@ -0,0 +1,49 @@
+# coding=utf-8
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir)))
+from spyder.config import logger, engine
+from spyder.model import BaseModel, DoubanBook
+from spyder.writer import BulkWriter
+from book import extract
+from bs4 import BeautifulSoup
+from sqlalchemy import text, inspect, func, select
+
+
+# 旧的 douban_book 每行是一本书 subject-item 的 html, 改名为 douban_book_html 后建出新表
+# 按 id 分批读出旧表, 用 book.py 的 extract 重新解析, 以原来的 id 写入新表
+# 中途中断时从新表最大的 id 之后继续; 旧表不会删除, 核对无误后手工 drop
+def migrate(batch_size=5000):
+    table, old = DoubanBook.__tablename__, DoubanBook.__tablename__ + '_html'
+    tables = engine.table_names()
+    if old not in tables:
+        if table not in tables or 'html' not in [column['name'] for column in inspect(engine).get_columns(table)]:
+            logger.warning('{} 不需要迁移'.format(table))
+            return 0
+        engine.execute('RENAME TABLE {} TO {}'.format(table, old))
+    BaseModel.metadata.create_all(engine, tables=[DoubanBook.__table__])
+
+    writer = BulkWriter(DoubanBook, batch_size=None)
+    last_id, count, failed = engine.execute(select([func.max(DoubanBook.id)])).scalar() or 0, 0, 0
+    while True:
+        rows = engine.execute(text('SELECT id, tag, html, create_date FROM {} WHERE id > :id ORDER BY id LIMIT :limit'
+                                   .format(old)), id=last_id, limit=batch_size).fetchall()
+        if not rows: break
+        for row in rows:
+            try:
+                book = extract(BeautifulSoup(row['html'], 'html.parser').find('li'))
+            except Exception:
+                failed += 1
+                continue
+            book.update(id=row['id'], tag=row['tag'], create_date=row['create_date'])
+            writer.add(book)
+        last_id, count = rows[-1]['id'], count + len(rows)
+        writer.flush()
+        logger.warning('{} 已迁移 {} 行'.format(table, count))
+    logger.warning('{} 迁移完毕, 共 {} 行, 解析失败 {} 行'.format(table, count, failed))
+    return count
+
+
+if __name__ == '__main__':
+    migrate()
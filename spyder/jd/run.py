@@ -2,28 +2,22 @@
 import sys
 import requests
 import json
-import time
-from datetime import datetime
+import threading
+from datetime import date
+from itertools import takewhile
 import os
-import multiprocessing
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir)))
-from spyder.config import DBSession, JD_max_iter, JD_url, logger, HEADER, get_proxy
-from spyder.config import return_none_when_exception, repeat_while_return_none
+from spyder.config import JD_max_iter, JD_url, logger, HEADER
+from spyder.crawler import Crawler, Request
 from spyder.model import JDWare as Ware
+from spyder.writer import BulkWriter
 
 
-def get(param):
-    time.sleep(1)
-    page, keyword = param
-    param = {'_format_': 'json', 'stock': 1, 'page': page, 'keyword': keyword}
-    proxy = get_proxy()
-    req = requests.post(JD_url, data=param, proxies=proxy, headers=HEADER, timeout=5)
-    if req.status_code != 200: raise Exception('error return code')
-    info = json.loads(json.loads(req.content).get('value'))
-    print 'get ware {} in page {} by {} done'.format(keyword, page, proxy.get('http'))
-    time.sleep(4)
-    return [Ware(key_word=keyword, json=json.dumps(ware, ensure_ascii=False), create_date=datetime.date(datetime.now()))
+def parse(respond, request):
+    info = json.loads(json.loads(respond.content).get('value'))
+    keyword = request.data['keyword']
+    return [{'key_word': keyword, 'json': json.dumps(ware, ensure_ascii=False), 'create_date': date.today()}
             for ware in info.get('wareList').get('wareList') or []]
 
 
@@ -36,32 +30,58 @@ def check_ware_count(keyword):
     ).get('wareList').get('wareCount')
 
 
+# 已写入 mysql 的分页, 每行 "页码\t商品数", 中断后重跑时跳过这些分页
+def load_checkpoint(path):
+    done = {}
+    if os.path.exists(path):
+        with open(path) as fp:
+            for line in fp:
+                page, count = line.split()
+                done[int(page)] = int(count)
+    return done
+
+
 if __name__ == '__main__':
     keyword = sys.argv[1]
-    batch_size = 25
-    ware_list = []
+    flush_size = 100
     ware_count = check_ware_count(keyword)
-    print 'start to get {} wares from JD'.format(ware_count)
-    for batch in range(JD_max_iter / batch_size):
-        pool = multiprocessing.Pool(processes=batch_size)
-        ware_list += reduce(
-            lambda x, y: x + y,
-            pool.map(
-                repeat_while_return_none(return_none_when_exception(get)),
-                zip(range(batch * batch_size, (batch + 1) * batch_size), [keyword] * batch_size)
-            )
-        )
-        pool.close()
-        pool.join()
-        print 'batch {} finish, acc ware count:{}'.format(batch, len(ware_list))
-        if len(ware_list) > ware_count: break
-    print 'get ware from JD finish'
+    checkpoint = '/tmp/{}_jd_{}.checkpoint'.format(date.today(), keyword)
+    done = load_checkpoint(checkpoint)
+    count = sum(done.values())
+    print 'start to get {} wares from JD, {} pages already done'.format(ware_count, len(done))
 
-    print 'start to dump ware to mysql'
-    session = DBSession()
-    session.add_all(ware_list)
-    session.commit()
-    session.close()
-    print 'dump ware to mysql finish'
+    # 按完成顺序把商品写入 mysql, 每 flush_size 页提交一次并记录 checkpoint, 内存中最多只有 flush_size 页的商品
+    # 翻过最后一页后只是不再发出新的分页, 在途的分页乱序完成, 仍然要全部写入
+    # 商品只在记录 checkpoint 时写入, 崩溃后重跑的分页不会重复写入
+    writer = BulkWriter(Ware, batch_size=None)
+    finished = []
+    fp = open(checkpoint, 'a')
+    stop = threading.Event()
+    if count > ware_count: stop.set()
+    pages = takewhile(lambda request: not stop.is_set(), (
+        Request(JD_url, 'post', {'_format_': 'json', 'stock': 1, 'page': page, 'keyword': keyword}, meta=page)
+        for page in range(JD_max_iter) if page not in done
+    ))
+    crawler = Crawler(domain_concurrency=25)
+    for result in crawler.crawl(pages, parse):
+        if result.error is not None:
+            logger.warning('get ware {} in page {} failed: {}'.format(keyword, result.request.meta, result.error))
+            continue
+        writer.extend(result.records)
+        finished.append((result.request.meta, len(result.records)))
+        count += len(result.records)
+        # 空页说明已经翻过最后一页
+        if count > ware_count or not result.records: stop.set()
+        if len(finished) >= flush_size:
+            writer.flush()
+            fp.writelines('{}\t{}\n'.format(*item) for item in finished)
+            fp.flush()
+            finished = []
+            print 'acc ware count:{}'.format(count)
+    writer.flush()
+    fp.writelines('{}\t{}\n'.format(*item) for item in finished)
+    fp.close()
+    print 'get ware from JD finish, ware count: {}'.format(count)
+    logger.warning('retry stats: {}'.format(crawler.stats()))
 
     print 'all done'
@@ -2,111 +2,205 @@
 import sys
 import requests
 import json
-import time
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from itertools import izip_longest
 import os
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir)))
-from spyder.config import DBSession, logger, ip_pool, User_Agent
+from spyder.config import logger, engine, HEADER
 from spyder.config import lagou_company_url, lagou_max_iter, lagou_city_json, lagou_stage_json, lagou_domain_json
-from spyder.model import LagouCompany as Company
+from spyder.config import lagou_concurrency, lagou_interval, lagou_probe_ttl
+from spyder.crawler import Crawler, Request
+from spyder.model import LagouCompany as Company, LagouProgress
+from spyder.writer import BulkWriter
+from spyder.state import CrawlStateStore
+from spyder.splitter import Splitter
+from schema import Dictionary, COMPANY_UPSERT, encode_company
+from sqlalchemy import text, select
+
+# 一个分片最多能翻到的公司数, 超过的分片继续按融资阶段、领域切分
+MAX_COUNT = 900
+PAGE_SIZE = 16
+UPSERT = text(
+    'INSERT INTO lagou_progress (shard, total_count, page_size, probe_time, last_page, run_date) '
+    'VALUES (:shard, :total_count, :page_size, :probe_time, :last_page, :run_date) '
+    'ON DUPLICATE KEY UPDATE total_count = VALUES(total_count), page_size = VALUES(page_size), '
+    'probe_time = VALUES(probe_time), last_page = VALUES(last_page), run_date = VALUES(run_date)'
+)
 
 cookie = requests.utils.dict_from_cookiejar(requests.get('http://m.lagou.com/').cookies)
 cookie.update({'LGUID': 'NULL'})
-cookie = ';'.join(['{}={}'.format(k, v) for k, v in cookie.items()])
-headers = requests.utils.default_headers()
-headers.update({'User-Agent': User_Agent, 'Cookie': cookie})
-
-
-def get(page, city=0, stage=0, domain=0):
-    param = {'first': 'false', 'pn': page, 'sortField': 0, 'havemark': 0}
-    try:
-        r = requests.post(lagou_company_url.format(city_code=city, stage_code=stage, domain_code=domain),
-                          proxies=ip_pool.gen_proxies(), data=param, headers=headers, timeout=5)
-        respond = json.loads(r.content) if r.status_code == 200 else None
-    except Exception:
-        respond = None
-    time.sleep(1)
-    return respond
-
-
-def is_small_city(city):
-    respond = get(page=0, city=city)
-    while respond is None:
-        respond = get(page=0, city=city)
-    company_count = int(respond['totalCount'])
-    if company_count < 900:
-        logger.warning('{} 公司数为 {} < 900, 执行全批抓取'.format(lagou_city_json[city_code], company_count))
-        return True
-    else:
-        logger.warning('{} 公司数为 {} > 900, 执行分批抓取'.format(lagou_city_json[city_code], company_count))
-        return False
-
-
-def dump(city, stage=0, domain=0):
-    if stage == 0 or domain == 0:
-        logger.warning('开始抓取 {} 的公司'.format(lagou_city_json[city]))
-    else:
-        logger.warning('开始抓取 {} {} 的 {} 公司'.format(
-            lagou_city_json[city],
-            lagou_stage_json[stage],
-            lagou_domain_json[domain]
-        ))
-    log = "抓取第 {} 页完毕, 当前页公司个数{}, 累计已抓{}, 该类别总计{}"
-    count = 0
-    page = 0
-    for i in range(lagou_max_iter):
-        page += 1
-        info = get(page=page, city=city, stage=stage, domain=domain)
-        while info is None:
-            info = get(page=page, city=city, stage=stage, domain=domain)
-        total_count = int(info['totalCount'])
-        company_list = info['result']
-        count += len(company_list)
-        logger.warning(log.format(page, len(company_list), count, total_count))
-        session = DBSession()
-        for company in company_list:
-            c = Company(
-                company_id=company.get("companyId"),
-                company_full_name=company.get("companyFullName"),
-                company_short_name=company.get("companyShortName"),
-                city=company.get("city"),
-                position_num=company.get("positionNum"),
-                city_score=company.get("cityScore"),
-                finance_stage=company.get("financeStage"),
-                industry_field=company.get("industryField"),
-                country_score=company.get("countryScore"),
-                company_features=company.get("companyFeatures"),
-                process_rate=company.get("processRate"),
-                interview_remark_num=company.get("interviewRemarkNum"),
-                approve=company.get("approve"),
-                create_time=datetime.now()
-            )
-            session.add(c)
-        session.commit()
-        session.close()
-        if len(company_list) == 0:
-            break
-    return count
+headers = dict(HEADER, Cookie=';'.join(['{}={}'.format(k, v) for k, v in cookie.items()]))
+
+
+def shard_key(partition):
+    # (城市, 融资阶段, 领域) 的前缀, 没有切分的维度为 0
+    return '-'.join(str(value) for value in tuple(partition) + (0,) * (3 - len(partition)))
+
+
+def request(shard, page):
+    city, stage, domain = shard.split('-')
+    return Request(
+        lagou_company_url.format(city_code=city, stage_code=stage, domain_code=domain), 'post',
+        {'first': 'false', 'pn': page, 'sortField': 0, 'havemark': 0}, headers, meta=(shard, page)
+    )
+
+
+def parse(respond, request):
+    info = json.loads(respond.content)
+    # 被限流时返回 {"success": false, "msg": ...}, 抛异常让抓取器换代理重试
+    if 'result' not in info: raise Exception(info.get('msg') or 'unexpected respond')
+    return info
+
+
+# 所有分片的进度, 启动时从 lagou_progress 表载入, 写入公司之后由 commit 提交
+# 同时作为 Splitter 的探测缓存, probe_ttl 天内的探测结果直接复用
+class Progress:
+    def __init__(self):
+        self._rows = dict(
+            (row['shard'], dict(row)) for row in engine.execute(select([LagouProgress.__table__]))
+        )
+        self._finished = {}
+        self._dirty = set()
+        for row in self._rows.values():
+            if row['run_date'] != date.today(): row.update(last_page=0, run_date=date.today())
+
+    def _row(self, shard):
+        return self._rows.setdefault(shard, {
+            'shard': shard, 'total_count': None, 'page_size': None, 'probe_time': None,
+            'last_page': 0, 'run_date': date.today()
+        })
+
+    def stale(self, shard):
+        probe_time = self._row(shard)['probe_time']
+        return probe_time is None or datetime.now() - probe_time > timedelta(days=lagou_probe_ttl)
+
+    def probed(self, shard, info):
+        self._row(shard).update(
+            total_count=int(info['totalCount']), page_size=int(info.get('pageSize') or PAGE_SIZE),
+            probe_time=datetime.now()
+        )
+        self._dirty.add(shard)
+
+    def get(self, partition):
+        shard = shard_key(partition)
+        return None if self.stale(shard) else self._row(shard)['total_count']
+
+    def set(self, partition, count):
+        self._row(shard_key(partition)).update(total_count=count, probe_time=datetime.now())
+        self._dirty.add(shard_key(partition))
+
+    def pages(self, shard):
+        # 分片中还没抓的分页
+        row = self._row(shard)
+        count = min(row['total_count'] or 0, MAX_COUNT)
+        last = min(-(-count // (row['page_size'] or PAGE_SIZE)), lagou_max_iter)
+        return range(row['last_page'] + 1, last + 1)
+
+    def finish(self, shard, page):
+        # 分页完成的顺序是乱的, last_page 只推进到连续完成的位置
+        finished = self._finished.setdefault(shard, set())
+        finished.add(page)
+        row = self._row(shard)
+        while row['last_page'] + 1 in finished:
+            row['last_page'] += 1
+            finished.remove(row['last_page'])
+            self._dirty.add(shard)
+
+    def commit(self):
+        rows = [self._rows[shard] for shard in self._dirty]
+        self._dirty = set()
+        if not rows: return
+        with engine.begin() as connection:
+            connection.execute(UPSERT, rows)
+
+
+def plan(crawler, progress, writer, dictionary):
+    # 每个城市一个根分片, 公司数超过 MAX_COUNT 的先按融资阶段切分, 仍然超过的再按领域切分
+    # 探测请求取分片的第一页, 同一层的分片并发探测; 第一页的公司直接写入, 分片记为已抓完第一页, 抓取时从第二页开始
+    def probe(partitions):
+        shards = dict((shard_key(partition), partition) for partition in partitions)
+        counts = {}
+        for result in crawler.crawl([request(shard, 1) for shard in shards], parse):
+            shard = result.request.meta[0]
+            if result.error is not None:
+                logger.warning('探测 {} 失败: {}'.format(shard, result.error))
+                continue
+            progress.probed(shard, result.records)
+            writer.extend(company(info, dictionary) for info in result.records['result'])
+            progress.finish(shard, 1)
+            counts[shards[shard]] = int(result.records['totalCount'])
+        writer.flush()
+        progress.commit()
+        return counts
+
+    splitter = Splitter([list(lagou_city_json), list(lagou_stage_json), list(lagou_domain_json)], MAX_COUNT, probe,
+                        progress)
+    leaves = splitter.plan([(city,) for city in lagou_city_json])
+    logger.warning('探测 {} 个分片, 得到 {} 个分片, 共 {} 个公司'.format(
+        splitter.probes, len(leaves), sum(count for _, count in leaves)))
+    return [shard_key(partition) for partition, _ in leaves]
+
+
+def company(info, dictionary):
+    return encode_company({
+        'company_id': info.get("companyId"),
+        'company_full_name': info.get("companyFullName"),
+        'company_short_name': info.get("companyShortName"),
+        'city': info.get("city"),
+        'position_num': info.get("positionNum"),
+        'city_score': info.get("cityScore"),
+        'finance_stage': info.get("financeStage"),
+        'industry_field': info.get("industryField"),
+        'country_score': info.get("countryScore"),
+        'company_features': info.get("companyFeatures"),
+        'process_rate': info.get("processRate"),
+        'interview_remark_num': info.get("interviewRemarkNum"),
+        'approve': info.get("approve"),
+    }, dictionary, date.today())
+
+
+def commit(writer, state, progress, done):
+    # 先写入公司, 再提交抓取状态和进度
+    writer.flush()
+    state.commit(state.key(item.url, item.data) for item in done)
+    progress.commit()
 
 
 if __name__ == '__main__':
-    current_count = 0
+    # 先探测分片再抓取分页, 两个阶段对拉勾的并发数和请求间隔都由 lagou_concurrency、lagou_interval 统一限制
     logger.warning('开始抓取')
-    for city_code, city_name in lagou_city_json.items():
-        if is_small_city(city_code):
-            current_count += dump(city_code)
-            logger.warning('抓取 {} 的公司完毕, 累计抓取{}'.format(lagou_city_json[city_code], current_count))
-            continue
+    crawler = Crawler(concurrency=lagou_concurrency, domain_concurrency=lagou_concurrency,
+                      domain_interval=lagou_interval, target='lagou')
+    progress = Progress()
+    state = CrawlStateStore()
+    dictionary = Dictionary()
+    writer = BulkWriter(Company, statement=COMPANY_UPSERT)
+    shards = plan(crawler, progress, writer, dictionary)
+    logger.warning('共 {} 个分片'.format(len(shards)))
+
+    # 各个分片的分页交替排列, 所有分片同时推进
+    pages = [[request(shard, page) for page in progress.pages(shard)] for shard in shards]
+    pages = [item for group in izip_longest(*pages) for item in group if item is not None]
+    logger.warning('待抓取 {} 页'.format(len(pages)))
 
-        for stage_code, stage_name in lagou_stage_json.items():
-            for domain_code, domain_name in lagou_domain_json.items():
-                current_count += dump(city=city_code, stage=stage_code, domain=domain_code)
-                logger.warning('抓取 {} {} 的 {} 公司完毕, 累计抓取 {}'.format(
-                    lagou_city_json[city_code],
-                    lagou_stage_json[stage_code],
-                    lagou_domain_json[domain_code],
-                    current_count
-                ))
-
-    logger.warning('抓取完毕')
+    # 增量抓取: 和上次抓到的公司列表相同的分页不再写入, 写入时内容没变的公司只更新 last_written
+    done, unchanged = [], 0
+    for result in Crawler(concurrency=lagou_concurrency, domain_concurrency=lagou_concurrency,
+                          domain_interval=lagou_interval, target='lagou', state=state).crawl(pages, parse):
+        shard, page = result.request.meta
+        if result.error is not None:
+            logger.warning('抓取 {} 第 {} 页失败: {}'.format(shard, page, result.error))
+            continue
+        # 内容没变但 ETag 变了的分页也有暂存的状态, 同样要提交
+        done.append(result.request)
+        if result.changed:
+            writer.extend(company(info, dictionary) for info in result.records['result'])
+        else:
+            unchanged += 1
+        progress.finish(shard, page)
+        if len(done) >= 50:
+            commit(writer, state, progress, done)
+            done = []
+    commit(writer, state, progress, done)
+    logger.warning('抓取完毕, 写入公司 {} 个, 未变化 {} 页'.format(writer.count, unchanged))
@@ -0,0 +1,47 @@
+# coding=utf-8
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir)))
+from spyder.config import logger, engine
+from spyder.model import BaseModel, LagouDict, LagouCompany, LagouJob
+from spyder.writer import BulkWriter
+from schema import Dictionary, COMPANY_UPSERT, JOB_UPSERT, encode_company, encode_job
+from sqlalchemy import text, inspect
+
+
+# 把全是 Text 列的旧表改名为 <表名>_text, 建出新表后按 id 分批读出旧表, 转换后写入新表
+# 写入按去重键 upsert, 中途中断可以直接重跑; 旧表不会删除, 核对无误后手工 drop
+def migrate(model, encode, statement, seen_column, dictionary, batch_size=5000):
+    table, old = model.__tablename__, model.__tablename__ + '_text'
+    tables = engine.table_names()
+    if old not in tables:
+        if table not in tables or 'row_hash' in [column['name'] for column in inspect(engine).get_columns(table)]:
+            logger.warning('{} 不需要迁移'.format(table))
+            return 0
+        engine.execute('RENAME TABLE {} TO {}'.format(table, old))
+    BaseModel.metadata.create_all(engine, tables=[model.__table__])
+
+    writer = BulkWriter(model, batch_size=batch_size, statement=statement)
+    last_id, count = 0, 0
+    while True:
+        rows = engine.execute(text('SELECT * FROM {} WHERE id > :id ORDER BY id LIMIT :limit'.format(old)),
+                              id=last_id, limit=batch_size).fetchall()
+        if not rows: break
+        for row in rows:
+            row = dict(row)
+            seen = row[seen_column].date() if row[seen_column] else None
+            writer.add(encode(row, dictionary, seen))
+        last_id, count = rows[-1]['id'], count + len(rows)
+        writer.flush()
+        logger.warning('{} 已迁移 {} 行'.format(table, count))
+    new_count = engine.execute(text('SELECT COUNT(*) FROM {}'.format(table))).scalar()
+    logger.warning('{} 迁移完毕, 旧表 {} 行, 去重后 {} 行'.format(table, count, new_count))
+    return count
+
+
+if __name__ == '__main__':
+    BaseModel.metadata.create_all(engine, tables=[LagouDict.__table__])
+    dictionary = Dictionary()
+    migrate(LagouCompany, encode_company, COMPANY_UPSERT, 'create_time', dictionary)
+    migrate(LagouJob, encode_job, JOB_UPSERT, 'crawint_time', dictionary)
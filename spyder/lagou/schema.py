@@ -0,0 +1,154 @@
+# coding=utf-8
+import json
+import re
+from datetime import datetime
+from sqlalchemy import text, select
+from spyder.config import engine
+from spyder.model import LagouDict, LagouCompany, LagouJob
+from spyder.model import LAGOU_WORK_YEAR, LAGOU_EDUCATION, LAGOU_JOB_NATURE, LAGOU_COMPANY_SIZE
+from spyder.state import digest
+
+SALARY = re.compile(r'(\d+)[kK]')
+
+
+def upsert(model):
+    # 同一行重复写入时只更新首次抓到和最近一次写入的日期
+    columns = [column.name for column in model.__table__.columns if column.name != 'id']
+    return text('INSERT INTO {} ({}) VALUES ({}) ON DUPLICATE KEY UPDATE '
+                'first_seen = LEAST(first_seen, VALUES(first_seen)), '
+                'last_written = GREATEST(last_written, VALUES(last_written))'.format(
+                    model.__tablename__, ', '.join('`{}`'.format(name) for name in columns),
+                    ', '.join(':' + name for name in columns)))
+
+
+COMPANY_UPSERT = upsert(LagouCompany)
+JOB_UPSERT = upsert(LagouJob)
+
+
+# lagou_dict 的编号, 启动时一次性载入, 遇到新的取值时插入并记下编号
+class Dictionary:
+    def __init__(self):
+        self._ids = dict(
+            ((kind, name), id) for id, kind, name in engine.execute(select([LagouDict.id, LagouDict.kind, LagouDict.name]))
+        )
+
+    def encode(self, kind, name):
+        name = to_text(name)
+        if name is None: return None
+        if (kind, name) not in self._ids:
+            result = engine.execute(LagouDict.__table__.insert(), kind=kind, name=name)
+            self._ids[(kind, name)] = result.inserted_primary_key[0]
+        return self._ids[(kind, name)]
+
+
+def to_text(value):
+    if isinstance(value, list): value = u','.join(value)
+    if isinstance(value, str): value = value.decode('utf-8')
+    if value is None or value == u'': return None
+    return unicode(value)
+
+
+def to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_bool(value):
+    value = to_int(value)
+    return None if value is None else bool(value)
+
+
+def to_datetime(value):
+    if isinstance(value, datetime): return value
+    try:
+        return datetime.strptime(to_text(value), '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+
+def choice(value, choices):
+    value = to_text(value)
+    return value if value in choices else None
+
+
+def salary(value):
+    # "10k-20k" 拆成 (10, 20), "20k以上" 为 (20, None)
+    values = [int(number) for number in SALARY.findall(to_text(value) or '')]
+    return (values[0] if values else None), (values[1] if len(values) > 1 else None)
+
+
+def finish(row, seen):
+    # 按转换后的内容算 row_hash, 内容相同的行在 mysql 中只保留一行
+    row['row_hash'] = digest(json.dumps(row, sort_keys=True, default=str))
+    row.update(first_seen=seen, last_written=seen)
+    return row
+
+
+# 公司和职位的原始字段 (列名和旧表相同, 值是拉勾返回的原值或旧表里的字符串) 转换成新表的一行, seen 为抓取日期
+def encode_company(raw, dictionary, seen):
+    return finish({
+        'company_id': to_int(raw.get('company_id')),
+        'company_full_name': to_text(raw.get('company_full_name')),
+        'company_short_name': to_text(raw.get('company_short_name')),
+        'city_id': dictionary.encode('city', raw.get('city')),
+        'position_num': to_int(raw.get('position_num')),
+        'city_score': to_float(raw.get('city_score')),
+        'finance_stage_id': dictionary.encode('finance_stage', raw.get('finance_stage')),
+        'industry_field_id': dictionary.encode('industry_field', raw.get('industry_field')),
+        'country_score': to_float(raw.get('country_score')),
+        'company_features': to_text(raw.get('company_features')),
+        'process_rate': to_int(raw.get('process_rate')),
+        'interview_remark_num': to_int(raw.get('interview_remark_num')),
+        'approve': to_bool(raw.get('approve')),
+    }, seen)
+
+
+def encode_job(raw, dictionary, seen):
+    salary_min, salary_max = salary(raw.get('salary'))
+    return finish({
+        'position_id': to_int(raw.get('position_id')),
+        'company_id': to_int(raw.get('company_id')),
+        'company_full_name': to_text(raw.get('company_full_name')),
+        'company_short_name': to_text(raw.get('company_short_name')),
+        'ad_word': to_int(raw.get('ad_word')),
+        'position_name': to_text(raw.get('position_name')),
+        'work_year': choice(raw.get('work_year'), LAGOU_WORK_YEAR),
+        'education': choice(raw.get('education'), LAGOU_EDUCATION),
+        'job_nature': choice(raw.get('job_nature'), LAGOU_JOB_NATURE),
+        'finance_stage_id': dictionary.encode('finance_stage', raw.get('finance_stage')),
+        'industry_field_id': dictionary.encode('industry_field', raw.get('industry_field')),
+        'city_id': dictionary.encode('city', raw.get('city')),
+        'salary_min': salary_min,
+        'salary_max': salary_max,
+        'position_advantage': to_text(raw.get('position_advantage')),
+        'district': to_text(raw.get('district')),
+        'company_label_list': to_text(raw.get('company_label_list')),
+        'approve': to_bool(raw.get('approve')),
+        'company_size': choice(raw.get('company_size'), LAGOU_COMPANY_SIZE),
+        'score': to_int(raw.get('score')),
+        'format_create_time': to_text(raw.get('format_create_time')),
+        'last_login': to_int(raw.get('last_login')),
+        'publisher_id': to_int(raw.get('publisher_id')),
+        'explain': to_text(raw.get('explain')),
+        'plus': to_text(raw.get('plus')),
+        'pc_show': to_int(raw.get('pc_show')),
+        'app_show': to_int(raw.get('app_show')),
+        'deliver': to_int(raw.get('deliver')),
+        'grade_description': to_text(raw.get('grade_description')),
+        'promotion_score_explain': to_text(raw.get('promotion_score_explain')),
+        'first_type': to_text(raw.get('first_type')),
+        'second_type': to_text(raw.get('second_type')),
+        'position_lables': to_text(raw.get('position_lables')),
+        'business_zones': to_text(raw.get('business_zones')),
+        'im_state': to_text(raw.get('im_state')),
+        'create_time': to_datetime(raw.get('create_time')),
+    }, seen)
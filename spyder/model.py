@@ -1,8 +1,16 @@
+# coding=utf-8
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Text, DateTime, Integer, String, Date
+from sqlalchemy import Column, Text, DateTime, Integer, BigInteger, SmallInteger, String, Date, Float, Boolean, Enum
+from sqlalchemy import UniqueConstraint
 
 BaseModel = declarative_base()
 
+# 拉勾职位的枚举字段, 不在其中的取值存为 NULL
+LAGOU_WORK_YEAR = (u'不限', u'应届毕业生', u'1年以下', u'1-3年', u'3-5年', u'5-10年', u'10年以上')
+LAGOU_EDUCATION = (u'不限', u'大专', u'本科', u'硕士', u'博士')
+LAGOU_JOB_NATURE = (u'全职', u'兼职', u'实习')
+LAGOU_COMPANY_SIZE = (u'少于15人', u'15-50人', u'50-150人', u'150-500人', u'500-2000人', u'2000人以上')
+
 
 class JDWare(BaseModel):
     __tablename__ = 'jd_ware'
@@ -26,78 +34,151 @@ class AuctionWare(BaseModel):
         return self.id
 
 
+# 每个服务器每天每种物品的一口价单价统计, 由 wow/run.py 在写快照时聚合
+class AuctionItemPrice(BaseModel):
+    __tablename__ = 'auction_item_price'
+    id = Column(Integer, primary_key=True)
+    realm = Column(String(32), index=True)
+    item = Column(Integer, index=True)
+    min_buyout = Column(BigInteger)
+    median_buyout = Column(BigInteger)
+    volume = Column(Integer)
+    auctions = Column(Integer)
+    create_date = Column(Date, index=True)
+
+    def __repr__(self):
+        return '[%s]%s' % (self.realm, self.item)
+
+
 class DoubanBook(BaseModel):
     __tablename__ = 'douban_book'
     id = Column(Integer, primary_key=True)
     tag = Column(String(10), index=True)
-    html = Column(Text)
+    subject_id = Column(Integer, index=True)
+    title = Column(String(255))
+    author = Column(String(255))
+    rating = Column(Float)
+    votes = Column(Integer)
+    price = Column(String(32))
     create_date = Column(Date, index=True)
 
     def __repr__(self):
-        return self.id
+        return '[%s]%s' % (self.id, self.title)
+
+
+# 每个抓取地址最近一次的 ETag、Last-Modified 和解析结果的 hash, 用于增量抓取, 见 state.py
+class CrawlState(BaseModel):
+    __tablename__ = 'crawl_state'
+    key_hash = Column(String(40), primary_key=True)
+    url = Column(Text)
+    etag = Column(String(128))
+    last_modified = Column(String(64))
+    content_hash = Column(String(40))
+    update_time = Column(DateTime)
+
+    def __repr__(self):
+        return self.url
+
+
+# 拉勾的城市、行业、融资阶段等取值有限的字符串, 按 kind 分别编号, 公司和职位表里只存编号, 见 lagou/schema.py
+class LagouDict(BaseModel):
+    __tablename__ = 'lagou_dict'
+    __table_args__ = (UniqueConstraint('kind', 'name', name='uk_kind_name'),)
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(16))
+    name = Column(String(128))
+
+    def __repr__(self):
+        return '[%s]%s' % (self.kind, self.name)
 
 
+# 每天抓到的公司按 (company_id, row_hash) 去重, 内容不变的公司只保留一行, first_seen 是首次抓到的日期
+# last_written 是最近一次写入的日期, 不是最近一次抓到的日期: 增量抓取时整页没有变化的分页不会重新写入, last_written 也不会更新
 class LagouCompany(BaseModel):
     __tablename__ = 'lagou_company'
+    __table_args__ = (UniqueConstraint('company_id', 'row_hash', name='uk_company'),)
     id = Column(Integer, primary_key=True)
-    company_id = Column(Text)
-    company_full_name = Column(Text)
-    company_short_name = Column(Text)
-    city = Column(Text)
-    position_num = Column(Text)
-    city_score = Column(Text)
-    finance_stage = Column(Text)
-    industry_field = Column(Text)
-    country_score = Column(Text)
+    company_id = Column(Integer)
+    row_hash = Column(String(40))
+    company_full_name = Column(String(255))
+    company_short_name = Column(String(128))
+    city_id = Column(SmallInteger)
+    position_num = Column(Integer)
+    city_score = Column(Float)
+    finance_stage_id = Column(SmallInteger)
+    industry_field_id = Column(SmallInteger)
+    country_score = Column(Float)
     company_features = Column(Text)
-    process_rate = Column(Text)
-    interview_remark_num = Column(Text)
-    approve = Column(Text)
-    create_time = Column(DateTime)
+    process_rate = Column(SmallInteger)
+    interview_remark_num = Column(Integer)
+    approve = Column(Boolean)
+    first_seen = Column(Date)
+    last_written = Column(Date, index=True)
 
     def __repr__(self):
         return '[%s]%s' % (self.id, self.company_short_name)
 
 
+# 拉勾公司列表按 (城市, 融资阶段, 领域) 分片抓取的进度, shard 为 "城市-阶段-领域", 0 表示不限
+# total_count 和 page_size 是分片第一页探测到的结果, 在 probe_time 之后的 probe_ttl 天内复用
+# last_page 是 run_date 当天已连续抓完并写入 mysql 的最后一页, 崩溃后从下一页继续
+class LagouProgress(BaseModel):
+    __tablename__ = 'lagou_progress'
+    shard = Column(String(32), primary_key=True)
+    total_count = Column(Integer)
+    page_size = Column(Integer)
+    probe_time = Column(DateTime)
+    last_page = Column(Integer)
+    run_date = Column(Date)
+
+    def __repr__(self):
+        return self.shard
+
+
+# 和 LagouCompany 一样按 (position_id, row_hash) 去重, 薪资拆成以 k 为单位的上下限
 class LagouJob(BaseModel):
     __tablename__ = 'lagou_job'
+    __table_args__ = (UniqueConstraint('position_id', 'row_hash', name='uk_job'),)
     id = Column(Integer, primary_key=True)
-    company_id = Column(Text)
-    company_full_name = Column(Text)
-    ad_word = Column(Text)
-    position_name = Column(Text)
-    work_year = Column(Text)
-    education = Column(Text)
-    job_nature = Column(Text)
-    finance_stage = Column(Text)
-    industry_field = Column(Text)
-    company_short_name = Column(Text)
-    city = Column(Text)
-    salary = Column(Text)
-    position_id = Column(Text)
+    position_id = Column(Integer)
+    row_hash = Column(String(40))
+    company_id = Column(Integer, index=True)
+    company_full_name = Column(String(255))
+    company_short_name = Column(String(128))
+    ad_word = Column(SmallInteger)
+    position_name = Column(String(255))
+    work_year = Column(Enum(*LAGOU_WORK_YEAR, name='work_year'))
+    education = Column(Enum(*LAGOU_EDUCATION, name='education'))
+    job_nature = Column(Enum(*LAGOU_JOB_NATURE, name='job_nature'))
+    finance_stage_id = Column(SmallInteger)
+    industry_field_id = Column(SmallInteger)
+    city_id = Column(SmallInteger)
+    salary_min = Column(SmallInteger)
+    salary_max = Column(SmallInteger)
     position_advantage = Column(Text)
-    district = Column(Text)
+    district = Column(String(64))
     company_label_list = Column(Text)
-    approve = Column(Text)
-    company_size = Column(Text)
-    score = Column(Text)
-    format_create_time = Column(Text)
-    last_login = Column(Text)
-    publisher_id = Column(Text)
+    approve = Column(Boolean)
+    company_size = Column(Enum(*LAGOU_COMPANY_SIZE, name='company_size'))
+    score = Column(Integer)
+    format_create_time = Column(String(32))
+    last_login = Column(BigInteger)
+    publisher_id = Column(Integer)
     explain = Column(Text)
-    plus = Column(Text)
-    pc_show = Column(Text)
-    app_show = Column(Text)
-    deliver = Column(Text)
+    plus = Column(String(16))
+    pc_show = Column(SmallInteger)
+    app_show = Column(SmallInteger)
+    deliver = Column(SmallInteger)
     grade_description = Column(Text)
     promotion_score_explain = Column(Text)
-    first_type = Column(Text)
-    second_type = Column(Text)
+    first_type = Column(String(64))
+    second_type = Column(String(64))
     position_lables = Column(Text)
     business_zones = Column(Text)
-    im_state = Column(Text)
-    create_time = Column(Text)
-    crawint_time = Column(DateTime)
+    im_state = Column(String(16))
+    create_time = Column(DateTime)
+    first_seen = Column(Date)
+    last_written = Column(Date, index=True)
 
     def __repr__(self):
         return '[%s]%s' % (self.id, self.company_short_name)
@@ -0,0 +1,49 @@
+# coding=utf-8
+from spyder.config import logger
+
+
+# 分页列表接口的自适应分片: 列表最多只能翻到 cap 条时, 按维度逐层切分, 只有超过 cap 的分片才继续往下切
+# dimensions 是各维度的取值列表, 分片是各维度取值组成的 tuple, 越短越粗, 长度为 n 的分片下一层按第 n 个维度切分
+# probe(partitions) 返回 {分片: 总数}, 同一层的分片一次探测, 调用方可以并发; 探测失败的分片不出现在结果中
+# cache 需要提供 get(分片) 和 set(分片, 总数), get 返回 None 表示需要重新探测, 拉勾用 lagou/company.py 的 Progress
+class Splitter:
+    def __init__(self, dimensions, cap, probe, cache=None):
+        self._dimensions = dimensions
+        self._cap = cap
+        self._probe = probe
+        self._cache = cache
+        self.probes = 0
+
+    def _count(self, partitions):
+        counts, missing = {}, []
+        for partition in partitions:
+            count = self._cache.get(partition) if self._cache is not None else None
+            if count is None:
+                missing.append(partition)
+            else:
+                counts[partition] = count
+        if missing:
+            self.probes += len(missing)
+            probed = self._probe(missing)
+            if self._cache is not None:
+                for partition, count in probed.items(): self._cache.set(partition, count)
+            counts.update(probed)
+        return counts
+
+    def plan(self, roots=((),)):
+        # 返回 [(分片, 总数)], 请求数只和实际的数据量有关, 而不是各维度大小的乘积
+        leaves, level = [], list(roots)
+        while level:
+            counts = self._count(level)
+            children = []
+            for partition in level:
+                count = counts.get(partition)
+                if not count: continue
+                depth = len(partition)
+                if count <= self._cap or depth >= len(self._dimensions):
+                    if count > self._cap: logger.warning('分片 {} 共 {} 条, 已无法再切分'.format(partition, count))
+                    leaves.append((partition, count))
+                else:
+                    children += [partition + (value,) for value in self._dimensions[depth]]
+            level = children
+        return leaves
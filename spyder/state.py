@@ -0,0 +1,72 @@
+# coding=utf-8
+import hashlib
+import json
+import threading
+from datetime import datetime
+from urllib import urlencode
+from sqlalchemy import text, select
+from spyder.config import engine
+from spyder.model import CrawlState
+
+UPSERT = text(
+    'INSERT INTO crawl_state (key_hash, url, etag, last_modified, content_hash, update_time) '
+    'VALUES (:key_hash, :url, :etag, :last_modified, :content_hash, :update_time) '
+    'ON DUPLICATE KEY UPDATE etag = VALUES(etag), last_modified = VALUES(last_modified), '
+    'content_hash = VALUES(content_hash), update_time = VALUES(update_time)'
+)
+
+
+def digest(value):
+    return hashlib.sha1(value).hexdigest()
+
+
+# 增量抓取的状态, 按地址 (POST 请求带上排序后的参数) 记录上次的 ETag、Last-Modified 和解析结果的 hash
+# 启动时一次性载入 crawl_state 表, 抓取过程中的变化先暂存在内存, 爬虫把对应的记录写入 mysql 之后再 commit 这些地址
+# 这样中途崩溃时只会重抓, 不会漏抓; 内容没变的请求也可能暂存了新的 ETag, 爬虫应当 commit 所有成功的请求
+class CrawlStateStore:
+    def __init__(self, batch_size=500):
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._states = dict(
+            (key_hash, (etag, last_modified, content_hash))
+            for key_hash, etag, last_modified, content_hash in engine.execute(select([
+                CrawlState.key_hash, CrawlState.etag, CrawlState.last_modified, CrawlState.content_hash
+            ]))
+        )
+        self._staged = {}
+
+    @staticmethod
+    def key(url, data=None):
+        return url + '?' + urlencode(sorted(data.items())) if data else url
+
+    def conditional(self, key):
+        # 条件请求的请求头, 服务端内容没变时返回 304
+        etag, last_modified, _ = self._states.get(digest(key), (None, None, None))
+        headers = {}
+        if etag: headers['If-None-Match'] = etag
+        if last_modified: headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def changed(self, key, records, etag=None, last_modified=None):
+        # 解析结果和上次相同时返回 False
+        key_hash = digest(key)
+        content_hash = digest(json.dumps(records, sort_keys=True, default=str))
+        state = (etag, last_modified, content_hash)
+        with self._lock:
+            old = self._states.get(key_hash)
+            if old == state: return False
+            # 内容没变但 ETag 变了时也要记下, 下次才能命中 304
+            self._states[key_hash] = state
+            self._staged[key_hash] = {
+                'key_hash': key_hash, 'url': key, 'etag': etag, 'last_modified': last_modified,
+                'content_hash': content_hash, 'update_time': datetime.now()
+            }
+        return old is None or old[2] != content_hash
+
+    def commit(self, keys):
+        with self._lock:
+            rows = filter(None, (self._staged.pop(digest(key), None) for key in keys))
+        if not rows: return
+        with engine.begin() as connection:
+            for i in range(0, len(rows), self._batch_size):
+                connection.execute(UPSERT, rows[i:i + self._batch_size])
@@ -1,72 +1,50 @@
 # coding=utf-8
 import sys
-import requests
 import json
-import time
 from datetime import date
+from operator import itemgetter
 import os
-import shutil
-import multiprocessing
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir)))
-from spyder.config import DBSession, HEADER, get_proxy, wow_url
-from spyder.config import return_none_when_exception, repeat_while_return_none
-from spyder.model import AuctionWare
+from spyder.config import logger, wow_url, wow_snapshot_path
+from spyder.crawler import Crawler, Request
+from spyder.model import AuctionItemPrice
+from spyder.writer import BulkWriter
+from snapshot import Snapshot, SnapshotStore, aggregate
 
 
-def get(param):
-    time.sleep(1)
-    realm, url = param
-    proxy = get_proxy()
-    req = requests.get(url, proxies=proxy, headers=HEADER, timeout=5)
-    if req.status_code != 200: raise Exception('error return code')
-    auctions = json.loads(req.content).get('auctions') or []
-    print 'get {} data by {} done'.format(realm, proxy.get('http'))
-    time.sleep(4)
-    fp = open('/tmp/{}_wow_auction_house/{}'.format(date.today(), realm), 'w')
-    map(lambda ware: fp.writelines('{}\n'.format(json.dumps(ware, ensure_ascii=False))), auctions)
-    fp.close()
-    return len(auctions)
+def parse(respond, request):
+    # 在抓取线程里直接转成按拍卖 id 排序、按列存储的快照, 不在内存里保留整份 json
+    auctions = json.loads(respond.content).get('auctions') or []
+    return Snapshot.from_auctions(sorted(auctions, key=itemgetter('auc')))
 
 
 if __name__ == '__main__':
-    print 'start to clean env'
-    path = '/tmp/{}_wow_auction_house'.format(date.today())
-    if os.path.exists(path):
-        shutil.rmtree(path)
-    os.mkdir(path)
-
-    print 'start to get wow auction house data'
-    pool = multiprocessing.Pool(processes=20)
-    count = reduce(
-        lambda x, y: x + y,
-        pool.map(
-            repeat_while_return_none(return_none_when_exception(get)),
-            wow_url.items()
-        )
-    )
-    pool.close()
-    pool.join()
-    print 'get wow auction house data finish, ware count: {}'.format(count)
-
+    # 每个服务器每天一个快照, 存在 <wow_snapshot_path>/<服务器>/ 下, 每 7 天一个完整快照, 其余只存和前一天的差异
+    # 按物品聚合的价格写入 auction_item_price
     print 'start to clean mysql dirty data'
-    session = DBSession()
-    session.query(AuctionWare).filter_by(create_date=date.today()).delete()
-    session.commit()
-    session.close()
+    writer = BulkWriter(AuctionItemPrice, batch_size=5000)
+    writer.delete(create_date=date.today())
 
-    print 'start to dump auction house data to mysql'
-    for realm in wow_url.keys():
-        session = DBSession()
-        fp = open('/tmp/{}_wow_auction_house/{}'.format(date.today(), realm))
-        data = [AuctionWare(realm=realm, json=line, create_date=date.today()) for line in fp]
-        session.add_all(data)
-        fp.close()
-        print 'dump {} to mysql finish'.format(realm)
-        session.commit()
-        session.close()
-    print 'dump auction house to mysql finish'
+    print 'start to get wow auction house data'
+    store = SnapshotStore(wow_snapshot_path)
+    # ip 池没有校验魔兽 api 的目标, 结果不上报, 以免影响京东的代理打分
+    crawler = Crawler(report=False)
+    count = 0
+    for result in crawler.crawl([Request(url, meta=realm) for realm, url in wow_url.items()], parse):
+        realm = result.request.meta
+        if result.error is not None:
+            logger.warning('get {} data failed: {}'.format(realm, result.error))
+            continue
+        snapshot = result.records
+        kind = store.save(realm, str(date.today()), snapshot)
+        for row in aggregate(snapshot):
+            row.update(realm=realm, create_date=date.today())
+            writer.add(row)
+        count += len(snapshot)
+        print 'dump {} {} finish, auction count: {}'.format(realm, kind, len(snapshot))
+    writer.flush()
+    print 'dump auction house finish, auction count: {}, item price count: {}'.format(count, writer.count)
+    logger.warning('retry stats: {}'.format(crawler.stats()))
 
-    print 'finally, clean env'
-    shutil.rmtree(path)
     print 'all done'
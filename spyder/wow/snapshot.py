@@ -0,0 +1,250 @@
+# coding=utf-8
+import json
+import os
+import struct
+import sys
+from array import array
+from itertools import chain, izip
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = 'WOWS'
+DELTA_MAGIC = 'WOWD'
+HEADER = struct.Struct('<4sI')
+# 列名, array 的类型码; owner 和 timeLeft 存成字符串表里的下标
+COLUMNS = (
+    ('auc', 'l'), ('item', 'i'), ('bid', 'l'), ('buyout', 'l'), ('quantity', 'i'), ('owner', 'i'), ('timeLeft', 'B'),
+)
+TIME_LEFT = ('SHORT', 'MEDIUM', 'LONG', 'VERY_LONG')
+DTYPE = {'l': '<i8', 'i': '<i4', 'B': 'u1'}
+
+
+# 一个服务器一次的拍卖行快照, 按列存储, 每列是一个 array
+# owner 按首次出现的顺序编号, 名字存在 owners 中
+class Snapshot:
+    def __init__(self, columns=None, owners=None):
+        self.columns = columns or dict((name, array(code)) for name, code in COLUMNS)
+        self.owners = owners or []
+        self._owner_index = dict((owner, i) for i, owner in enumerate(self.owners))
+
+    @classmethod
+    def from_auctions(cls, auctions):
+        snapshot = cls()
+        for auction in auctions: snapshot.append(auction)
+        return snapshot
+
+    def append(self, auction):
+        owner = auction.get('owner', '')
+        if owner not in self._owner_index:
+            self._owner_index[owner] = len(self.owners)
+            self.owners.append(owner)
+        time_left = auction.get('timeLeft')
+        columns = self.columns
+        columns['auc'].append(auction['auc'])
+        columns['item'].append(auction['item'])
+        columns['bid'].append(auction.get('bid', 0))
+        columns['buyout'].append(auction.get('buyout', 0))
+        columns['quantity'].append(auction.get('quantity', 1))
+        columns['owner'].append(self._owner_index[owner])
+        columns['timeLeft'].append(TIME_LEFT.index(time_left) if time_left in TIME_LEFT else 0)
+
+    def __len__(self):
+        return len(self.columns['auc'])
+
+    def row(self, i):
+        # 第 i 行还原成 dict
+        row = dict((name, self.columns[name][i]) for name, _ in COLUMNS)
+        row['owner'] = self.owners[row['owner']]
+        row['timeLeft'] = TIME_LEFT[row['timeLeft']]
+        return row
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def write(self, fp):
+        # 格式: MAGIC, 头部长度, json 头部 (行数、各列类型和字节宽度、owner 表), 之后依次是各列的原始字节
+        header = json.dumps({
+            'count': len(self),
+            'columns': [(name, code, array(code).itemsize) for name, code in COLUMNS],
+            'owners': self.owners,
+        }, ensure_ascii=False).encode('utf-8')
+        fp.write(HEADER.pack(MAGIC, len(header)))
+        fp.write(header)
+        for name, _ in COLUMNS:
+            self.columns[name].tofile(fp)
+
+    def dump(self, path):
+        with atomic(path) as fp:
+            self.write(fp)
+
+
+class atomic:
+    # 先写临时文件再改名, 中途崩溃不会留下写了一半的快照
+    def __init__(self, path):
+        self._path = path
+
+    def __enter__(self):
+        if not os.path.exists(os.path.dirname(self._path)): os.makedirs(os.path.dirname(self._path))
+        self._fp = open(self._path + '.tmp', 'wb')
+        return self._fp
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._fp.close()
+        if exc_type is None: os.rename(self._path + '.tmp', self._path)
+
+
+def read(fp, as_numpy=False):
+    magic, size = HEADER.unpack(fp.read(HEADER.size))
+    if magic != MAGIC: raise ValueError('not a snapshot: {}'.format(fp.name))
+    header = json.loads(fp.read(size).decode('utf-8'))
+    columns = {}
+    for name, code, itemsize in header['columns']:
+        if as_numpy:
+            columns[name] = numpy.fromfile(fp, dtype=DTYPE[code], count=header['count'])
+            continue
+        column = array(str(code))
+        if column.itemsize != itemsize: raise ValueError('column {} width mismatch: {}'.format(name, fp.name))
+        column.fromfile(fp, header['count'])
+        columns[name] = column
+    if as_numpy: return columns, header['owners']
+    return Snapshot(columns, header['owners'])
+
+
+def load(path, as_numpy=False):
+    # as_numpy 时各列返回 numpy 数组 (需要安装 numpy), 否则返回 Snapshot
+    if as_numpy and numpy is None: raise ImportError('numpy is required for as_numpy')
+    with open(path, 'rb') as fp:
+        return read(fp, as_numpy)
+
+
+# 两个快照按拍卖 id 的差异: 新增的拍卖、字段有变化的拍卖 (都是完整的行) 和消失的拍卖 id
+# 直接按列比较, 只有新增和变化的行才还原成 dict; 两个快照的 owner 表不同, owner 要换算成 new 中的下标再比较
+def diff(old, new):
+    names = [name for name, _ in COLUMNS]
+    owner = names.index('owner')
+    owner_map = [new._owner_index.get(name) for name in old.owners]
+    old_rows = dict((row[0], row) for row in izip(*[old.columns[name] for name in names]))
+    added, changed = Snapshot(), Snapshot()
+    for i, row in enumerate(izip(*[new.columns[name] for name in names])):
+        previous = old_rows.pop(row[0], None)
+        if previous is None:
+            added.append(new.row(i))
+        elif previous[:owner] != row[:owner] or previous[owner + 1:] != row[owner + 1:] \
+                or owner_map[previous[owner]] != row[owner]:
+            changed.append(new.row(i))
+    return added, changed, array('l', sorted(old_rows))
+
+
+# 在 old 上应用差异, 还原出的快照按拍卖 id 排序
+def patch(old, added, changed, removed):
+    rows = dict((row['auc'], row) for row in old)
+    for auc in removed: rows.pop(auc, None)
+    for row in chain(added, changed): rows[row['auc']] = row
+    return Snapshot.from_auctions(rows[auc] for auc in sorted(rows))
+
+
+def dump_delta(path, added, changed, removed):
+    # 格式: DELTA_MAGIC, 消失的拍卖数, 消失的拍卖 id, 之后是新增和变化的两个快照
+    with atomic(path) as fp:
+        fp.write(HEADER.pack(DELTA_MAGIC, len(removed)))
+        removed.tofile(fp)
+        added.write(fp)
+        changed.write(fp)
+
+
+def load_delta(path):
+    with open(path, 'rb') as fp:
+        magic, count = HEADER.unpack(fp.read(HEADER.size))
+        if magic != DELTA_MAGIC: raise ValueError('not a delta file: {}'.format(path))
+        removed = array('l')
+        removed.fromfile(fp, count)
+        return read(fp), read(fp), removed
+
+
+# 按服务器存放的快照序列, 目录为 <root>/<服务器>/, 每次抓取一个 tag (一般是日期, 按字符串排序即时间顺序)
+# 每 keyframe_interval 个 tag 存一个完整快照 <tag>.snap, 其余只存相对上一个 tag 的差异 <tag>.delta
+# load 从最近的完整快照开始依次应用差异, 还原任意一个 tag 的快照
+# 最近一个差异 tag 的完整快照另存一份 <tag>.cache, 下次 save 直接和它比较, 不用从完整快照开始重放
+class SnapshotStore:
+    def __init__(self, root, keyframe_interval=7):
+        self._root = root
+        self._keyframe_interval = keyframe_interval
+
+    def _path(self, realm, tag, ext):
+        return os.path.join(self._root, realm, '{}.{}'.format(tag, ext))
+
+    def tags(self, realm):
+        # [(tag, 'snap' 或 'delta')], 按 tag 排序
+        directory = os.path.join(self._root, realm)
+        if not os.path.exists(directory): return []
+        return sorted(tuple(name.rsplit('.', 1)) for name in os.listdir(directory)
+                      if name.endswith('.snap') or name.endswith('.delta'))
+
+    def load(self, realm, tag):
+        if os.path.exists(self._path(realm, tag, 'cache')): return load(self._path(realm, tag, 'cache'))
+        sequence = []
+        for name, ext in self.tags(realm):
+            if name > tag: break
+            sequence = [] if ext == 'snap' else sequence
+            sequence.append((name, ext))
+        if not sequence or sequence[-1][0] != tag: raise KeyError('no snapshot of {} at {}'.format(realm, tag))
+        snapshot = load(self._path(realm, sequence[0][0], 'snap'))
+        for name, ext in sequence[1:]:
+            snapshot = patch(snapshot, *load_delta(self._path(realm, name, ext)))
+        return snapshot
+
+    def _cache(self, realm, tag, snapshot):
+        # 只保留 tag 的缓存, snapshot 为 None 时 (完整快照本身就能直接读) 全部删掉
+        directory = os.path.join(self._root, realm)
+        for name in os.listdir(directory):
+            if name.endswith('.cache') and name != '{}.cache'.format(tag): os.remove(os.path.join(directory, name))
+        if snapshot is not None: snapshot.dump(self._path(realm, tag, 'cache'))
+
+    def save(self, realm, tag, snapshot):
+        history = [(name, ext) for name, ext in self.tags(realm) if name < tag]
+        since_keyframe = 0
+        for name, ext in reversed(history):
+            if ext == 'snap': break
+            since_keyframe += 1
+        # 重跑同一个 tag 时先删掉旧文件
+        for ext in ('snap', 'delta', 'cache'):
+            if os.path.exists(self._path(realm, tag, ext)): os.remove(self._path(realm, tag, ext))
+        if not history or since_keyframe + 1 >= self._keyframe_interval:
+            snapshot.dump(self._path(realm, tag, 'snap'))
+            self._cache(realm, tag, None)
+            return 'snap'
+        dump_delta(self._path(realm, tag, 'delta'), *diff(self.load(realm, history[-1][0]), snapshot))
+        self._cache(realm, tag, snapshot)
+        return 'delta'
+
+
+# 按物品聚合一口价的单价: 最低价、中位数, 以及数量和拍卖数, 没有一口价的拍卖不计入价格
+def aggregate(snapshot):
+    prices, volume, auctions = {}, {}, {}
+    columns = snapshot.columns
+    for item, buyout, quantity in zip(columns['item'], columns['buyout'], columns['quantity']):
+        volume[item] = volume.get(item, 0) + quantity
+        auctions[item] = auctions.get(item, 0) + 1
+        if buyout > 0 and quantity > 0: prices.setdefault(item, []).append(buyout // quantity)
+    result = []
+    for item in volume:
+        unit = sorted(prices.get(item, []))
+        result.append({
+            'item': item,
+            'min_buyout': unit[0] if unit else None,
+            'median_buyout': unit[len(unit) // 2] if unit else None,
+            'volume': volume[item],
+            'auctions': auctions[item],
+        })
+    return result
+
+
+if __name__ == '__main__':
+    # 还原一个快照, 按行输出 json, 用于导入 hive: python snapshot.py <root> <服务器> <tag>
+    root, realm, tag = sys.argv[1:4]
+    for row in SnapshotStore(root).load(realm, tag):
+        print json.dumps(row, ensure_ascii=False).encode('utf-8')
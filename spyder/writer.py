@@ -0,0 +1,45 @@
+# coding=utf-8
+from sqlalchemy import and_
+from spyder.config import engine
+
+
+# 按固定批次把行写入 mysql, 每攒够 batch_size 行用一条 executemany 的 insert 写入, 不经过 ORM 的 session
+# 行是 {列名: 值} 的 dict, 用法:
+#   with BulkWriter(AuctionWare) as writer:
+#       writer.add({'realm': realm, 'json': line, 'create_date': today})
+# statement 可以替换默认的 insert, 比如带 ON DUPLICATE KEY UPDATE 的 text 语句
+# batch_size 为 None 时不自动写入, 只在调用 flush 时写入, 用于和 checkpoint、抓取状态的提交对齐
+class BulkWriter:
+    def __init__(self, model, batch_size=1000, statement=None):
+        self._table = model.__table__
+        self._insert = self._table.insert() if statement is None else statement
+        self._batch_size = batch_size
+        self._rows = []
+        self.count = 0
+
+    def add(self, row):
+        self._rows.append(row)
+        if self._batch_size is not None and len(self._rows) >= self._batch_size: self.flush()
+
+    def extend(self, rows):
+        for row in rows: self.add(row)
+
+    def flush(self):
+        rows, self._rows = self._rows, []
+        if not rows: return
+        with engine.begin() as connection:
+            connection.execute(self._insert, rows)
+        self.count += len(rows)
+
+    def delete(self, **kwargs):
+        # 删除满足条件的行, 用于重跑前清理当天的脏数据
+        with engine.begin() as connection:
+            connection.execute(self._table.delete().where(
+                and_(*[self._table.c[key] == value for key, value in kwargs.items()])
+            ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None: self.flush()